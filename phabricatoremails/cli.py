@@ -4,6 +4,8 @@
 
 import argparse
 import os
+import sys
+from typing import Callable
 
 import sentry_sdk
 from phabricatoremails.prepare import prepare
@@ -12,6 +14,19 @@ from phabricatoremails.service import service
 from phabricatoremails.settings import IniSettings, SETTINGS_PATH_ENV_KEY
 from statsd import StatsClient
 
+# Largest statsd datagram that still fits within a typical Ethernet MTU. Each
+# service run flushes its counters as a single statsd pipeline, so this lets the
+# whole batch go out in one packet (and one syscall) rather than several.
+STATSD_MAX_UDP_SIZE = 1400
+
+# Each command's function and its help text. The argparse subcommands are built from
+# this, and it's also used to dispatch bare command names without argparse.
+_COMMANDS: dict[str, tuple[Callable[..., None], str]] = {
+    "prepare": (prepare, "Initialize the database"),
+    "migrate": (migrate, "Update the database schema"),
+    "service": (service, "Fetch events and send emails"),
+}
+
 
 def parse_command():
     parser = argparse.ArgumentParser()
@@ -21,24 +36,25 @@ def parse_command():
         title="commands",
         help="Defines the work that phabricator-emails should do",
     )
-    prepare_parser = commands.add_parser("prepare", help="Initialize the database")
-    migrate_parser = commands.add_parser("migrate", help="Update the database schema")
-    service_parser = commands.add_parser("service", help="Fetch events and send emails")
-
-    prepare_parser.set_defaults(func=prepare)
-    migrate_parser.set_defaults(func=migrate)
-    service_parser.set_defaults(func=service)
+    for name, (func, help_text) in _COMMANDS.items():
+        commands.add_parser(name, help=help_text).set_defaults(func=func)
     return parser.parse_args()
 
 
 def cli():
-    args = parse_command()
+    if len(sys.argv) == 2 and sys.argv[1] in _COMMANDS:
+        # The usual invocation is just the bare command name, so it can be
+        # dispatched without building the full argparse parser.
+        func, _ = _COMMANDS[sys.argv[1]]
+    else:
+        func = parse_command().func
+
     settings = IniSettings.load(os.environ.get(SETTINGS_PATH_ENV_KEY))
     if settings.sentry_dsn:
         sentry_sdk.init(settings.sentry_dsn)
 
     parameters = [settings]
-    if args.func == service:
-        parameters.append(StatsClient())
+    if func == service:
+        parameters.append(StatsClient(maxudpsize=STATSD_MAX_UDP_SIZE))
 
-    args.func(*parameters)
+    func(*parameters)
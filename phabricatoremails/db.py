@@ -3,6 +3,7 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 from contextlib import contextmanager
+from functools import lru_cache
 
 from alembic import command
 from alembic.config import Config as AlembicConfig
@@ -12,6 +13,12 @@ from sqlalchemy.engine import Engine
 from sqlalchemy.orm import sessionmaker
 
 
+@lru_cache(maxsize=None)
+def _alembic_config():
+    """Load the alembic configuration, which doesn't change at runtime."""
+    return AlembicConfig(str(PACKAGE_DIRECTORY / "alembic.ini"))
+
+
 class DBInitializedError(Exception):
     pass
 
@@ -26,11 +33,20 @@ class DB:
     Provides an SQLAlchemy session. Opens the connection to the database when
     the context manager is entered, and commits/rollbacks + closes the connection
     when the context manager is exited.
+
+    Objects aren't expired when the session commits, so any that are read after
+    the transaction are stale snapshots rather than being re-loaded.
     """
 
     def __init__(self, engine: Engine):
+        """Wrap the provided engine.
+
+        The service only uses one connection at a time, but that connection sits idle
+        in the engine's pool between polls. So, the engine should be created with
+        "pool_pre_ping" and "pool_recycle" to avoid failing on a stale connection.
+        """
         self._engine = engine
-        self._session_class = sessionmaker(bind=engine)
+        self._session_class = sessionmaker(bind=engine, expire_on_commit=False)
 
     def fetch_alembic_revision(self):
         """Return the current alembic version of the database."""
@@ -44,8 +60,7 @@ class DB:
 
     @staticmethod
     def upgrade_schema():
-        config = AlembicConfig(str(PACKAGE_DIRECTORY / "alembic.ini"))
-        command.upgrade(config, "head")
+        command.upgrade(_alembic_config(), "head")
 
     @contextmanager
     def session(self):
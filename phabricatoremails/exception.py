@@ -2,4 +2,13 @@ import traceback
 
 
 def render_exception(e: Exception):
-    return "".join(traceback.format_exception(type(e), e, e.__traceback__))
+    """Format the exception and its traceback.
+
+    The formatted text is stored on the exception so that reporting the same error
+    more than once doesn't walk its traceback again.
+    """
+    rendered = getattr(e, "_rendered_traceback", None)
+    if rendered is None:
+        rendered = "".join(traceback.format_exception(type(e), e, e.__traceback__))
+        setattr(e, "_rendered_traceback", rendered)
+    return rendered
@@ -3,27 +3,55 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 import logging.config
+from functools import lru_cache
+from typing import Callable
 
 _LOGGER_KEY = "phabricator-emails"
 
 
-def _create_logger(config: dict):
-    logging.config.dictConfig(config)
+@lru_cache(maxsize=1)
+def _create_logger(config_factory: Callable[[], dict]):
+    """Apply the logging configuration and return the logger.
+
+    "dictConfig" rebuilds every handler and formatter, so it's only re-run when a
+    different configuration is requested than the one most recently applied.
+    """
+    logging.config.dictConfig(config_factory())
     return logging.getLogger(_LOGGER_KEY)
 
 
+def _dev_config():
+    return {
+        "version": 1,
+        "handlers": {"console": {"level": "DEBUG", "class": "logging.StreamHandler"}},
+        "loggers": {_LOGGER_KEY: {"handlers": ["console"], "level": "DEBUG"}},
+    }
+
+
+def _production_config():
+    return {
+        "version": 1,
+        "formatters": {
+            "json": {
+                "()": "dockerflow.logging.JsonLogFormatter",
+                "logger_name": _LOGGER_KEY,
+            }
+        },
+        "handlers": {
+            "console": {
+                "level": "DEBUG",
+                "class": "logging.StreamHandler",
+                "formatter": "json",
+            }
+        },
+        "loggers": {_LOGGER_KEY: {"handlers": ["console"], "level": "DEBUG"}},
+    }
+
+
 def create_dev_logger():
     """Creates a logger for use when performing local development."""
 
-    return _create_logger(
-        {
-            "version": 1,
-            "handlers": {
-                "console": {"level": "DEBUG", "class": "logging.StreamHandler"}
-            },
-            "loggers": {_LOGGER_KEY: {"handlers": ["console"], "level": "DEBUG"}},
-        }
-    )
+    return _create_logger(_dev_config)
 
 
 def create_logger():
@@ -36,22 +64,4 @@ def create_logger():
     logger" from create_dev_logger() should be used instead.
     """
 
-    return _create_logger(
-        {
-            "version": 1,
-            "formatters": {
-                "json": {
-                    "()": "dockerflow.logging.JsonLogFormatter",
-                    "logger_name": _LOGGER_KEY,
-                }
-            },
-            "handlers": {
-                "console": {
-                    "level": "DEBUG",
-                    "class": "logging.StreamHandler",
-                    "formatter": "json",
-                }
-            },
-            "loggers": {_LOGGER_KEY: {"handlers": ["console"], "level": "DEBUG"}},
-        }
-    )
+    return _create_logger(_production_config)
@@ -5,22 +5,110 @@ import base64
 import enum
 import hashlib
 import pathlib
+import random
+import re
 import smtplib
 import struct
+import sys
 from builtins import classmethod
-from dataclasses import dataclass
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
 from email.header import Header
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
 from email.utils import formatdate
 from enum import Enum
+from functools import lru_cache
 from logging import Logger
 from typing import Optional, Protocol
 
 import boto3
+import botocore.exceptions
+from botocore.config import Config
 from mypy_boto3_ses import SESClient
 
 from phabricatoremails.render.events.common import Actor
+from phabricatoremails.slots import slotted
+
+# Local development renders can produce thousands of files, so a batch of emails is
+# written with a few writes in flight at once.
+_FS_MAX_CONCURRENT_WRITES = 4
+
+# SES requests spend most of their time waiting on the network, so a batch of
+# emails is sent with a few requests in flight at once. By default, this is kept
+# small to stay well within SES's per-second sending quota.
+SES_DEFAULT_MAX_CONCURRENT_SENDS = 4
+
+# Brief SES rate limiting is retried in-place (with backoff) rather than surfacing
+# as a temporary failure, which would hold up the whole event for the retry delay.
+# This keeps the five attempts of botocore's legacy default, while using the
+# "standard" mode's jittered backoff, which is better suited to concurrent sends.
+_SES_CLIENT_CONFIG = Config(retries={"max_attempts": 5, "mode": "standard"})
+
+
+@lru_cache(maxsize=1024)
+def _thread_index_base(thread_id: str):
+    """Return the 27 bytes that uniquely identify a thread in "Thread-Index".
+
+    These must never change for a given thread, otherwise Outlook would split
+    the emails of existing threads apart. They're cached because a burst of emails
+    for a single revision all share the same thread.
+    """
+    thread_id_md5 = hashlib.md5(thread_id.encode("utf-8")).hexdigest()
+    return thread_id_md5.encode("utf-8")[:27]
+
+
+@lru_cache(maxsize=1024)
+def _thread_identifiers(revision_id: int, from_domain: str):
+    """Return the thread id and the message id of the thread's imaginary first email.
+
+    Like "_thread_index_base()", these are shared by every email of a revision.
+    """
+    thread_id = f"revision-{revision_id}"
+    return thread_id, f"<{thread_id}@{from_domain}>"
+
+
+# Precompiled format for the big-endian timestamp trailer of "Thread-Index".
+_THREAD_INDEX_TRAILER = struct.Struct(">i")
+
+
+def _address_domain(address: str):
+    return address.rpartition("@")[2]
+
+
+_NEWLINE_RE = re.compile(r"\r\n|\r")
+
+
+def _mime_header(name: str, value: str):
+    """Format a header line the same way the "email" package's generator would."""
+    if value.isascii() and "\n" not in value and "\r" not in value:
+        return f"{name}: {value}\n"
+    return f"{name}: {Header(value, header_name=name).encode(maxlinelen=0)}\n"
+
+
+def _mime_text_part(subtype: str, text: str):
+    """Format a "text/*" MIME part the same way that "MIMEText" would.
+
+    ASCII text is sent as-is, anything else is UTF-8 encoded as base64.
+    """
+    if text.isascii():
+        charset, encoding = "us-ascii", "7bit"
+        payload = _NEWLINE_RE.sub("\n", text)
+    else:
+        charset, encoding = "utf-8", "base64"
+        payload = base64.encodebytes(text.encode("utf-8")).decode("ascii")
+    return (
+        f'Content-Type: text/{subtype}; charset="{charset}"\n'
+        "MIME-Version: 1.0\n"
+        f"Content-Transfer-Encoding: {encoding}\n"
+        "\n"
+        f"{payload}"
+    )
+
+
+def _mime_boundary(parts: list[str]):
+    while True:
+        boundary = f"{'=' * 15}{random.randrange(sys.maxsize):019d}=="
+        if not any(f"--{boundary}" in part for part in parts):
+            return boundary
 
 
 class SendEmailState(Enum):
@@ -29,6 +117,7 @@ class SendEmailState(Enum):
     PERMANENT_FAILURE = enum.auto()
 
 
+@slotted
 @dataclass
 class SendEmailResult:
     """Result from sending email."""
@@ -38,6 +127,7 @@ class SendEmailResult:
     exception: Optional[Exception] = None
 
 
+@slotted
 @dataclass
 class OutgoingEmail:
     """Represents a protocol-agnostic email."""
@@ -50,6 +140,12 @@ class OutgoingEmail:
     html_contents: str
     text_contents: str
     actor: Optional[Actor] = None
+    _mime_messages: dict[tuple[str, bool, str], bytes] = field(
+        default_factory=dict, init=False, repr=False, compare=False
+    )
+    _mime_body: Optional[tuple[str, str]] = field(
+        default_factory=lambda: None, init=False, repr=False, compare=False
+    )
 
     def encode_from(self, from_address):
         if self.actor:
@@ -58,10 +154,10 @@ class OutgoingEmail:
         else:
             return from_address
 
-    def _generate_threading_headers(self, from_address):
+    def _generate_threading_headers(self, from_domain):
         """Return a dictionary of all necessary threading mail headers.
 
-        Uses from_address to decide which domain to associate the thread with.
+        Uses from_domain to decide which domain to associate the thread with.
         """
 
         # There's four email threading headers that we use:
@@ -75,9 +171,9 @@ class OutgoingEmail:
         # This is sufficient for email clients to associate emails together into a
         # thread. Then, we have them sort the messages either by timestamp or the
         # trailer of "Thread-Index" (for Outlook).
-        thread_id = f"revision-{self.revision_id}"
-        domain = from_address.split("@")[1]
-        thread_message_id = f"<{thread_id}@{domain}>"
+        thread_id, thread_message_id = _thread_identifiers(
+            self.revision_id, from_domain
+        )
 
         # The Thread-Index header is used by Outlook to group and sort email threads.
         # Its format is:
@@ -88,37 +184,110 @@ class OutgoingEmail:
         # "generateThreadIndex()". We generate our unique first 27 bytes by
         # hashing our unique thread id, then encode the current timestamp as
         # the last 4 bytes.
-        thread_id_md5 = hashlib.md5(thread_id.encode("utf-8")).hexdigest()
-        thread_index_base = thread_id_md5.encode("utf-8")[:27]
-        thread_index = thread_index_base + b" " + struct.pack(">i", self.timestamp)
+        thread_index = (
+            _thread_index_base(thread_id)
+            + b" "
+            + _THREAD_INDEX_TRAILER.pack(self.timestamp)
+        )
 
         return {
             "Thread-Topic": thread_id,
-            "Thread-Index": base64.encodebytes(thread_index).decode("utf-8"),
+            "Thread-Index": base64.b64encode(thread_index).decode("ascii"),
             "In-Reply-To": thread_message_id,
             "References": thread_message_id,
         }
 
-    def to_mime_message(self, from_address, include_target_in_subject=False):
-        msg = MIMEMultipart("alternative")
-        msg["From"] = self.encode_from(from_address)
-        msg["To"] = self.to
-        msg["Date"] = formatdate(timeval=self.timestamp)
-        msg["Subject"] = (
+    def _encoded_body(self):
+        """Return the multipart boundary and the encoded body that it delimits.
+
+        The body doesn't depend on the sender or subject, so it's only encoded once
+        and shared between every variant of the message's headers.
+        """
+        if self._mime_body is None:
+            parts = [
+                _mime_text_part("plain", self.text_contents),
+                _mime_text_part("html", self.html_contents),
+            ]
+            boundary = _mime_boundary(parts)
+            delimiter = f"--{boundary}\n"
+            body = delimiter + f"\n{delimiter}".join(parts) + f"\n--{boundary}--\n"
+            self._mime_body = (boundary, body)
+        return self._mime_body
+
+    def to_raw_message(
+        self, from_address, include_target_in_subject=False, from_domain=None
+    ):
+        """Build the serialized "multipart/alternative" MIME message.
+
+        This is assembled directly as text rather than with "MIMEMultipart" and
+        "MIMEText": the output is identical, but skips the "email" package's
+        generic policy and generator machinery.
+
+        Mailers parse "from_domain" once up-front and pass it in, rather than it
+        being parsed from "from_address" for every email.
+        """
+        if from_domain is None:
+            from_domain = _address_domain(from_address)
+        subject = (
             f"|{self.to}| {self.subject}" if include_target_in_subject else self.subject
         )
-        for name, value in self._generate_threading_headers(from_address).items():
-            msg[name] = value
+        boundary, body = self._encoded_body()
+
+        headers = [
+            f'Content-Type: multipart/alternative; boundary="{boundary}"\n',
+            "MIME-Version: 1.0\n",
+            _mime_header("From", self.encode_from(from_address)),
+            _mime_header("To", self.to),
+            _mime_header("Date", formatdate(timeval=self.timestamp)),
+            _mime_header("Subject", subject),
+        ]
+        for name, value in self._generate_threading_headers(from_domain).items():
+            headers.append(_mime_header(name, value))
+
+        return "".join(headers) + "\n" + body
+
+    def to_mime_bytes(
+        self,
+        from_address,
+        include_target_in_subject=False,
+        from_domain=None,
+        linesep="\n",
+    ):
+        """Return the serialized MIME message, ready to be handed to a mailer.
+
+        Every header and body part is already encoded down to ASCII, so the message
+        is encoded once here rather than by "smtplib" or botocore on each attempt.
+        SMTP requires "\r\n" line endings, which "smtplib" only adds to "str"
+        messages, so SMTP callers pass them as "linesep".
 
-        msg.attach(MIMEText(self.text_contents, "plain"))
-        msg.attach(MIMEText(self.html_contents, "html"))
-        return msg
+        The result is cached, since an email is serialized again each time that
+        sending it is retried.
+        """
+        key = (from_address, include_target_in_subject, linesep)
+        mime_bytes = self._mime_messages.get(key)
+        if mime_bytes is None:
+            raw_message = self.to_raw_message(
+                from_address, include_target_in_subject, from_domain
+            )
+            if linesep != "\n":
+                raw_message = raw_message.replace("\n", linesep)
+            mime_bytes = raw_message.encode("ascii")
+            self._mime_messages[key] = mime_bytes
+        return mime_bytes
 
 
 class Mail(Protocol):
     def send(self, email: OutgoingEmail) -> SendEmailResult:
         pass
 
+    def send_many(self, emails: list[OutgoingEmail]) -> list[SendEmailResult]:
+        """Send emails, returning their results in the same order."""
+        pass
+
+    def close(self):
+        """Release the resources used to send emails."""
+        pass
+
 
 class FsMail:
     """Writes emails to the file system.
@@ -129,6 +298,7 @@ class FsMail:
 
     _logger: Logger
     _from_address: str
+    _from_domain: str
     _email_count: int
     _output_path: pathlib.Path
     _eml_path: pathlib.Path
@@ -138,6 +308,7 @@ class FsMail:
     def __init__(self, from_address: str, logger: Logger, output_path: pathlib.Path):
         self._logger = logger
         self._from_address = from_address
+        self._from_domain = _address_domain(from_address)
         self._email_count = 0
 
         self._output_path = output_path
@@ -148,23 +319,46 @@ class FsMail:
         self._html_path.mkdir(parents=True, exist_ok=True)
         self._text_path.mkdir(parents=True, exist_ok=True)
 
-        self._logger.debug(f'Recording emails to the "{self._output_path}" directory.')
+        self._logger.debug('Recording emails to the "%s" directory.', self._output_path)
+
+    def _outputs(self, email: OutgoingEmail):
+        """Return the files to write for the email, as (path, contents) pairs."""
+        basefilename = f"{self._email_count}-to-{email.to}"
+        self._email_count += 1
+        eml = email.to_mime_bytes(self._from_address, from_domain=self._from_domain)
+        return [
+            (self._eml_path / (basefilename + ".eml"), eml),
+            (self._html_path / (basefilename + ".html"), email.html_contents.encode()),
+            (self._text_path / (basefilename + ".text"), email.text_contents.encode()),
+        ]
 
     def send(self, email: OutgoingEmail) -> SendEmailResult:
         """Write the provided emails to files."""
 
-        basefilename = f"{self._email_count}-to-{email.to}"
-        with (self._eml_path / (basefilename + ".eml")).open("w") as file:
-            file.write(email.to_mime_message(self._from_address).as_string())
-        with (self._html_path / (basefilename + ".html")).open("w") as file:
-            file.write(email.html_contents)
-        with (self._text_path / (basefilename + ".text")).open("w") as file:
-            file.write(email.text_contents)
-
-        self._email_count += 1
+        for path, contents in self._outputs(email):
+            path.write_bytes(contents)
         return SendEmailResult(SendEmailState.SUCCESS)
 
+    def send_many(self, emails: list[OutgoingEmail]) -> list[SendEmailResult]:
+        """Write the files for all the emails, overlapping the writes."""
+
+        if not emails:
+            return []
+
+        # Files are named (and so, numbered) up-front so that the output is the same
+        # regardless of the order that the writes complete in.
+        outputs = [output for email in emails for output in self._outputs(email)]
+        paths, contents = zip(*outputs)
+        with ThreadPoolExecutor(max_workers=_FS_MAX_CONCURRENT_WRITES) as executor:
+            # Consume the results so that any failed write is raised.
+            list(executor.map(pathlib.Path.write_bytes, paths, contents))
+        return [SendEmailResult(SendEmailState.SUCCESS) for _ in emails]
+
+    def close(self):
+        pass
 
+
+@slotted
 @dataclass
 class SmtpMail:
     """Sends emails via SMTP.
@@ -176,38 +370,89 @@ class SmtpMail:
     be sent to the email address specified, rather than to their intended
     recipients. This is useful for a single developer testing sending different emails
     to different users while only having a single physical mail account.
+
+    The connection to the SMTP server is kept open and reused for every email. Since
+    it sits idle between polls, the server may close it. If "host" is provided,
+    then the connection is re-opened when that happens.
     """
 
     _server: smtplib.SMTP
     _from_address: str
     _logger: Logger
     _send_to: Optional[str]
+    _host: Optional[str] = None
+    _from_domain: str = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self._from_domain = _address_domain(self._from_address)
 
     def send(self, email: OutgoingEmail) -> SendEmailResult:
         """Send emails via SMTP."""
         self._logger.debug(
-            f'[{email.to}] Sending "{email.template_path}" for "{email.subject}"'
+            '[%s] Sending "%s" for "%s"', email.to, email.template_path, email.subject
         )
 
-        mime_message = email.to_mime_message(
-            self._from_address, include_target_in_subject=self._send_to is not None
-        )
-        self._server.sendmail(
+        mime_message = email.to_mime_bytes(
             self._from_address,
-            self._send_to if self._send_to else email.to,
-            mime_message.as_string(),
+            include_target_in_subject=self._send_to is not None,
+            from_domain=self._from_domain,
+            linesep="\r\n",
         )
+        destination = self._send_to if self._send_to else email.to
+        try:
+            try:
+                self._server.sendmail(self._from_address, destination, mime_message)
+            except smtplib.SMTPServerDisconnected:
+                if self._host is None:
+                    raise
+                self._logger.debug("Reconnecting to SMTP server %s", self._host)
+                self._server.connect(self._host)
+                # "smtplib" remembers the EHLO response from the old connection,
+                # so it has to be explicitly re-sent.
+                self._server.ehlo()
+                self._server.sendmail(self._from_address, destination, mime_message)
+        except (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError) as error:
+            return SendEmailResult(
+                SendEmailState.TEMPORARY_FAILURE, type(error).__name__, error
+            )
+        except smtplib.SMTPException:
+            # The server rejected the email, which retrying won't fix.
+            raise
+        except OSError as error:
+            # The server couldn't be reached: the connection was refused or reset,
+            # timed out, or its host couldn't be resolved.
+            return SendEmailResult(
+                SendEmailState.TEMPORARY_FAILURE, type(error).__name__, error
+            )
         return SendEmailResult(SendEmailState.SUCCESS)
 
+    def send_many(self, emails: list[OutgoingEmail]) -> list[SendEmailResult]:
+        return [self.send(email) for email in emails]
+
+    def close(self):
+        """Close the connection to the SMTP server."""
+        self._server.close()
 
+
+@slotted
 @dataclass
 class SesMail:
     """Sends emails via Amazon SES."""
 
-    _client: SESClient
+    _client: Optional[SESClient]
     _from_address: str
     _logger: Logger
     _send_to: Optional[str]
+    _aws_access_key_id: Optional[str] = field(default=None, repr=False)
+    _aws_secret_access_key: Optional[str] = field(default=None, repr=False)
+    _aws_session_token: Optional[str] = field(default=None, repr=False)
+    _max_concurrent_sends: int = SES_DEFAULT_MAX_CONCURRENT_SENDS
+    _from_domain: str = field(init=False, repr=False)
+    _executor: Optional[ThreadPoolExecutor] = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self._from_domain = _address_domain(self._from_address)
+        self._executor = None
 
     @classmethod
     def from_aws_credentials(
@@ -218,44 +463,68 @@ class SesMail:
         aws_access_key_id: Optional[str] = None,
         aws_secret_access_key: Optional[str] = None,
         aws_session_token: Optional[str] = None,
+        max_concurrent_sends: int = SES_DEFAULT_MAX_CONCURRENT_SENDS,
     ):
         """Automatically creates an SES client.
 
         Uses aws credentials either from parameters, or from the environment.
+        The client itself isn't constructed until the first email is sent, since
+        loading the SES service model is slow and often not needed.
 
         The "send_to" option is for debugging purposes. If set, then all emails will
         be sent to the email address specified, rather than to their intended
         recipients. This is useful for a single developer testing sending different
         emails to different users while only having a single physical mail account.
+
+        Batches of emails are sent with up to "max_concurrent_sends" requests in
+        flight at once.
         """
-        client = boto3.client(
-            "ses",
-            aws_access_key_id=aws_access_key_id,
-            aws_secret_access_key=aws_secret_access_key,
-            aws_session_token=aws_session_token,
+        return cls(
+            None,
+            from_address,
+            logger,
+            send_to,
+            aws_access_key_id,
+            aws_secret_access_key,
+            aws_session_token,
+            max_concurrent_sends,
         )
-        return cls(client, from_address, logger, send_to)
+
+    def _get_client(self) -> SESClient:
+        if self._client is None:
+            self._client = boto3.client(
+                "ses",
+                aws_access_key_id=self._aws_access_key_id,
+                aws_secret_access_key=self._aws_secret_access_key,
+                aws_session_token=self._aws_session_token,
+                # The connection pool is sized to match the concurrent sends, so
+                # each one reuses a warm connection.
+                config=_SES_CLIENT_CONFIG.merge(
+                    Config(max_pool_connections=self._max_concurrent_sends)
+                ),
+            )
+        return self._client
 
     def send(self, email: OutgoingEmail) -> SendEmailResult:
         """Send emails via SES with the send_raw_email API."""
 
         self._logger.debug(
-            f'[{email.to}] Sending "{email.template_path}" for "{email.subject}"'
+            '[%s] Sending "%s" for "%s"', email.to, email.template_path, email.subject
         )
 
         destination = self._send_to if self._send_to else email.to
-        mime_message = email.to_mime_message(
-            self._from_address, include_target_in_subject=self._send_to is not None
+        mime_message = email.to_mime_bytes(
+            self._from_address,
+            include_target_in_subject=self._send_to is not None,
+            from_domain=self._from_domain,
         )
 
-        import botocore.exceptions
-
         try:
             # send_raw_email() is used instead of send_email() because it provides
             # greater flexibility, such as specifying the `Date` header (which isn't
             # possible with `send_email()`).
-            self._client.send_raw_email(
-                RawMessage={"Data": mime_message.as_string()},
+            self._get_client().send_raw_email(
+                RawMessage={"Data": mime_message},
                 Source=email.encode_from(self._from_address),
                 Destinations=[destination],
             )
@@ -272,3 +541,37 @@ class SesMail:
             error_code = error.response["Error"]["Code"]
             return SendEmailResult(SendEmailState.TEMPORARY_FAILURE, error_code, error)
         return SendEmailResult(SendEmailState.SUCCESS)
+
+    def send_many(self, emails: list[OutgoingEmail]) -> list[SendEmailResult]:
+        """Send emails concurrently, returning their results in the same order."""
+        if len(emails) <= 1:
+            return [self.send(email) for email in emails]
+
+        # Boto3 clients are thread-safe, but creating one isn't.
+        self._get_client()
+        futures = [self._get_executor().submit(self.send, email) for email in emails]
+        _, pending = wait(futures, return_when=FIRST_EXCEPTION)
+        if pending:
+            # A send raised an unexpected error (rather than returning a failed
+            # result), such as missing credentials. Like when sending serially, the
+            # error is raised right away and the emails that weren't sent yet are
+            # abandoned.
+            for future in pending:
+                future.cancel()
+            for future in futures:
+                if future.done() and not future.cancelled():
+                    error = future.exception()
+                    if error is not None:
+                        raise error
+        return [future.result() for future in futures]
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self._max_concurrent_sends)
+        return self._executor
+
+    def close(self):
+        """Stop the threads used to send emails concurrently."""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
@@ -6,11 +6,12 @@ from dataclasses import dataclass
 from typing import Protocol
 
 from phabricatoremails.models import QueryPosition
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm import Session
 
 
 class QueryPositionStore(Protocol):
-    def get_position(self) -> QueryPosition:
+    def get_position_key(self) -> int:
         """Get the current position on the Phabricator feed.
 
         This position describes which Phabricator events
@@ -19,6 +20,10 @@ class QueryPositionStore(Protocol):
         """
         pass
 
+    def advance_position(self, position_key: int):
+        """Move the current position on the Phabricator feed to "position_key"."""
+        pass
+
     def set_initial_position(self, position_key: int):
         """Set starting position on Phabricator feed.
 
@@ -33,13 +38,29 @@ class QueryPositionStore(Protocol):
 
 @dataclass
 class DBQueryPositionStore:
-    """Perform operations on the QueryPosition table."""
+    """Perform operations on the QueryPosition table.
+
+    The position is only ever read and written as a single column of the table's one
+    row, so it's done directly rather than by loading (and flushing) an ORM instance.
+    """
 
     _db_session: Session
 
-    def get_position(self):
-        return self._db_session.query(QueryPosition).one()
+    def get_position_key(self):
+        (up_to_key,) = self._db_session.query(QueryPosition.up_to_key).one()
+        return up_to_key
+
+    def advance_position(self, position_key: int):
+        self._db_session.query(QueryPosition).update(
+            {QueryPosition.up_to_key: position_key}, synchronize_session=False
+        )
 
     def set_initial_position(self, position_key: int):
-        position = QueryPosition(up_to_key=position_key)
-        self._db_session.add(position)
+        # An upsert, so that seeding the position again (e.g. after a "prepare" that
+        # failed part-way) replaces the single row rather than conflicting with it.
+        statement = insert(QueryPosition).values(id=True, up_to_key=position_key)
+        statement = statement.on_conflict_do_update(
+            index_elements=[QueryPosition.id],
+            set_={QueryPosition.up_to_key: statement.excluded.up_to_key},
+        )
+        self._db_session.execute(statement)
@@ -5,8 +5,10 @@
 from dataclasses import dataclass
 from datetime import timezone, timedelta
 from enum import Enum
-from math import floor, ceil
-from typing import Optional
+from functools import lru_cache
+from typing import Optional, TypeVar
+
+from phabricatoremails.slots import slotted
 
 """Describes data structures that are used by both secure and public revision events.
 
@@ -14,6 +16,7 @@ Additional information about this module can be found in __init__.py
 """
 
 
+@slotted
 @dataclass
 class CommentMessage:
     as_text: str
@@ -31,6 +34,7 @@ class CommentMessage:
         return cls.parse(message) if message else None
 
 
+@slotted
 @dataclass
 class Actor:
     user_name: str
@@ -41,6 +45,29 @@ class Actor:
         return cls(actor["userName"], actor["realName"])
 
 
+E = TypeVar("E", bound=Enum)
+
+
+def enum_values(enum_type: type[E]) -> dict[str, E]:
+    """Map each of the enum's values to its member.
+
+    Indexing this is cheaper than a "EnumType(value)" lookup. An unknown value
+    raises a KeyError instead of a ValueError.
+    """
+    return {member.value: member for member in enum_type}
+
+
+@lru_cache(maxsize=None)
+def _parse_timezone(offset_seconds: int):
+    """Return the timezone for a UTC offset, truncated to whole minutes.
+
+    Recipients share a small set of offsets, so the timezones are cached.
+    """
+    minutes = abs(offset_seconds) // 60
+    return timezone(timedelta(minutes=-minutes if offset_seconds < 0 else minutes))
+
+
+@slotted
 @dataclass
 class Recipient:
     email: str
@@ -50,17 +77,10 @@ class Recipient:
 
     @classmethod
     def parse(cls, recipient: dict):
-        offset_seconds = recipient["timezoneOffset"]  # e.g.: -25200
-        if offset_seconds > 0:
-            hours = floor(offset_seconds / 3600)
-            minutes = floor((offset_seconds - hours * 3600) / 60)
-        else:
-            hours = ceil(offset_seconds / 3600)
-            minutes = ceil((offset_seconds - hours * 3600) / 60)
         return cls(
             recipient["email"],
             recipient["username"],
-            timezone(timedelta(hours=hours, minutes=minutes)),
+            _parse_timezone(recipient["timezoneOffset"]),  # e.g.: -25200
             recipient["isActor"],
         )
 
@@ -80,6 +100,10 @@ class ReviewerStatus(Enum):
     UNREVIEWED = "unreviewed"
 
 
+REVIEWER_STATUSES = enum_values(ReviewerStatus)
+
+
+@slotted
 @dataclass
 class Reviewer:
     name: str
@@ -92,7 +116,7 @@ class Reviewer:
         return cls(
             reviewer["name"],
             reviewer["isActionable"],
-            ReviewerStatus(reviewer["status"]),
+            REVIEWER_STATUSES[reviewer["status"]],
             Recipient.parse_many(reviewer["recipients"]),
         )
 
@@ -13,7 +13,10 @@ from phabricatoremails.render.events.common import (
     ParseError,
     ReviewerStatus,
     CommentMessage,
+    REVIEWER_STATUSES,
+    enum_values,
 )
+from phabricatoremails.slots import slotted
 
 """Describes data structures that are used by public revision events.
 
@@ -21,6 +24,7 @@ Additional information about this module can be found in __init__.py
 """
 
 
+@slotted
 @dataclass
 class Bug:
     id: int
@@ -28,6 +32,7 @@ class Bug:
     link: str
 
 
+@slotted
 @dataclass
 class Revision:
     id: int
@@ -51,6 +56,7 @@ class Revision:
         )
 
 
+@slotted
 @dataclass
 class MinimalRevision:
     id: int
@@ -61,6 +67,7 @@ class MinimalRevision:
         return cls(revision["revisionId"], revision["link"])
 
 
+@slotted
 @dataclass
 class ReplyContext:
     other_author: str
@@ -74,6 +81,10 @@ class DiffLineType(Enum):
     NO_CHANGE = "no-change"
 
 
+_DIFF_LINE_TYPES = enum_values(DiffLineType)
+
+
+@slotted
 @dataclass
 class DiffLine:
     number: int
@@ -81,6 +92,17 @@ class DiffLine:
     raw_content: str
 
 
+def _parse_diff(raw_diff: list[dict]):
+    # Diffs can have many lines, so the names used for each line are bound locally
+    # rather than being looked up as globals every time.
+    diff_line, line_types = DiffLine, _DIFF_LINE_TYPES
+    return [
+        diff_line(line["lineNumber"], line_types[line["type"]], line["rawContent"])
+        for line in raw_diff
+    ]
+
+
+@slotted
 @dataclass
 class CodeContext:
     diff: list[DiffLine]
@@ -89,6 +111,7 @@ class CodeContext:
 InlineCommentContext = Union[ReplyContext, CodeContext]
 
 
+@slotted
 @dataclass
 class InlineComment:
     file_context: str
@@ -102,14 +125,7 @@ class InlineComment:
         raw_context = inline["context"]
         if context_kind == "code":
             context = CodeContext(
-                [
-                    DiffLine(
-                        line["lineNumber"],
-                        DiffLineType(line["type"]),
-                        line["rawContent"],
-                    )
-                    for line in raw_context["diff"]
-                ]
+                _parse_diff(raw_context["diff"])
             )  # type: InlineCommentContext
         elif context_kind == "reply":
             context = ReplyContext(
@@ -138,6 +154,10 @@ class AffectedFileChange(Enum):
     MODIFIED = "modified"
 
 
+_AFFECTED_FILE_CHANGES = enum_values(AffectedFileChange)
+
+
+@slotted
 @dataclass
 class AffectedFile:
     path: str
@@ -145,7 +165,7 @@ class AffectedFile:
 
     @classmethod
     def parse(cls, file: dict):
-        return cls(file["path"], AffectedFileChange(file["change"]))
+        return cls(file["path"], _AFFECTED_FILE_CHANGES[file["change"]])
 
     @classmethod
     def parse_many(cls, files: list[dict]):
@@ -158,6 +178,10 @@ class ExistenceChange(Enum):
     NO_CHANGE = "no-change"
 
 
+_EXISTENCE_CHANGES = enum_values(ExistenceChange)
+
+
+@slotted
 @dataclass
 class MetadataEditedReviewer:
     name: str
@@ -171,8 +195,8 @@ class MetadataEditedReviewer:
         return cls(
             reviewer["name"],
             reviewer["isActionable"],
-            ReviewerStatus(reviewer["status"]),
-            ExistenceChange(reviewer["metadataChange"]),
+            REVIEWER_STATUSES[reviewer["status"]],
+            _EXISTENCE_CHANGES[reviewer["metadataChange"]],
             Recipient.parse_many(reviewer["recipients"]),
         )
 
@@ -181,6 +205,7 @@ class MetadataEditedReviewer:
         return list(map(cls.parse, reviewers))
 
 
+@slotted
 @dataclass
 class RevisionAbandoned:
     KIND = "revision-abandoned"
@@ -201,6 +226,7 @@ class RevisionAbandoned:
         )
 
 
+@slotted
 @dataclass
 class RevisionCreated:
     KIND = "revision-created"
@@ -217,6 +243,7 @@ class RevisionCreated:
         )
 
 
+@slotted
 @dataclass
 class RevisionReclaimed:
     KIND = "revision-reclaimed"
@@ -237,6 +264,7 @@ class RevisionReclaimed:
         )
 
 
+@slotted
 @dataclass
 class RevisionAccepted:
     KIND = "revision-accepted"
@@ -263,6 +291,7 @@ class RevisionAccepted:
         )
 
 
+@slotted
 @dataclass
 class RevisionCommented:
     KIND = "revision-commented"
@@ -285,6 +314,7 @@ class RevisionCommented:
         )
 
 
+@slotted
 @dataclass
 class RevisionClosed:
     KIND = "revision-closed"
@@ -307,6 +337,7 @@ class RevisionClosed:
         )
 
 
+@slotted
 @dataclass
 class RevisionLanded:
     KIND = "revision-landed"
@@ -329,6 +360,7 @@ class RevisionLanded:
         )
 
 
+@slotted
 @dataclass
 class RevisionCommentPinged:
     KIND = "revision-comment-pinged"
@@ -347,6 +379,7 @@ class RevisionCommentPinged:
         )
 
 
+@slotted
 @dataclass
 class RevisionRequestedChanges:
     KIND = "revision-requested-changes"
@@ -369,6 +402,7 @@ class RevisionRequestedChanges:
         )
 
 
+@slotted
 @dataclass
 class RevisionRequestedReview:
     KIND = "revision-requested-review"
@@ -389,6 +423,7 @@ class RevisionRequestedReview:
         )
 
 
+@slotted
 @dataclass
 class RevisionMetadataEdited:
     KIND = "revision-metadata-edited"
@@ -411,6 +446,7 @@ class RevisionMetadataEdited:
         )
 
 
+@slotted
 @dataclass
 class RevisionUpdated:
     KIND = "revision-updated"
@@ -6,6 +6,7 @@ from dataclasses import dataclass
 from typing import Optional
 
 from phabricatoremails.render.events.common import Recipient, Reviewer
+from phabricatoremails.slots import slotted
 
 """Describes data structures that are used by secure revision events.
 
@@ -18,12 +19,14 @@ Additional information about this module can be found in __init__.py
 """
 
 
+@slotted
 @dataclass
 class SecureBug:
     id: int
     link: str
 
 
+@slotted
 @dataclass
 class SecureRevision:
     id: int
@@ -37,6 +40,7 @@ class SecureRevision:
         return cls(revision["revisionId"], revision["link"], bug)
 
 
+@slotted
 @dataclass
 class SecureRevisionAbandoned:
     reviewers: list[Recipient]
@@ -54,6 +58,7 @@ class SecureRevisionAbandoned:
         )
 
 
+@slotted
 @dataclass
 class SecureRevisionCreated:
     reviewers: list[Reviewer]
@@ -67,6 +72,7 @@ class SecureRevisionCreated:
         )
 
 
+@slotted
 @dataclass
 class SecureRevisionReclaimed:
     reviewers: list[Reviewer]
@@ -84,6 +90,7 @@ class SecureRevisionReclaimed:
         )
 
 
+@slotted
 @dataclass
 class SecureRevisionAccepted:
     lando_link: Optional[str]
@@ -107,6 +114,7 @@ class SecureRevisionAccepted:
         )
 
 
+@slotted
 @dataclass
 class SecureRevisionCommented:
     author: Optional[Recipient]
@@ -124,6 +132,7 @@ class SecureRevisionCommented:
         )
 
 
+@slotted
 @dataclass
 class SecureRevisionClosed:
     author: Optional[Recipient]
@@ -143,6 +152,7 @@ class SecureRevisionClosed:
         )
 
 
+@slotted
 @dataclass
 class SecureRevisionLanded:
     author: Optional[Recipient]
@@ -158,6 +168,7 @@ class SecureRevisionLanded:
         )
 
 
+@slotted
 @dataclass
 class SecureRevisionCommentPinged:
     recipient: Recipient
@@ -171,6 +182,7 @@ class SecureRevisionCommentPinged:
         )
 
 
+@slotted
 @dataclass
 class SecureRevisionRequestedChanges:
     author: Optional[Recipient]
@@ -190,6 +202,7 @@ class SecureRevisionRequestedChanges:
         )
 
 
+@slotted
 @dataclass
 class SecureRevisionRequestedReview:
     reviewers: list[Reviewer]
@@ -207,6 +220,7 @@ class SecureRevisionRequestedReview:
         )
 
 
+@slotted
 @dataclass
 class SecureRevisionUpdated:
     is_ready_to_land: bool
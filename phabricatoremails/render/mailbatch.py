@@ -2,19 +2,28 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import re
+import secrets
 from dataclasses import dataclass
+from datetime import timezone
 from typing import Optional
 
 from phabricatoremails.mail import OutgoingEmail
 from phabricatoremails.render.events.common import Recipient, Actor
 from phabricatoremails.render.events.phabricator import Revision
 from phabricatoremails.render.events.phabricator_secure import SecureRevision
-from phabricatoremails.render.template import TemplateStore
+from phabricatoremails.render.template import Template, TemplateStore
+from phabricatoremails.slots import slotted
 
 PUBLIC_TEMPLATE_PATH_PREFIX = "public/"
 SECURE_TEMPLATE_PATH_PREFIX = "secure/"
+# Phabricator usernames are limited to these characters, which are output as-is in
+# both the HTML and text emails. Any other username is rendered on its own rather
+# than being substituted into a shared render.
+_SUBSTITUTABLE_USERNAME_RE = re.compile(r"[A-Za-z0-9._-]+")
 
 
+@slotted
 @dataclass
 class Target:
     """Parameters to create an email for a specific recipient."""
@@ -22,9 +31,39 @@ class Target:
     template_path: str
     recipient_email: str
     recipient_username: str
+    recipient_timezone: timezone
     kwargs: dict
 
 
+def render_for_usernames(
+    template: Template, template_params: dict, usernames: list[str]
+) -> list[tuple[str, str]]:
+    """Render the template for each of the recipient usernames.
+
+    The username only appears verbatim in the email (in the footer's link to the
+    recipient's email preferences), so the template is rendered once with a unique
+    placeholder, which is then replaced by each username.
+    """
+    if not usernames:
+        return []
+
+    if len(usernames) == 1 or not all(
+        _SUBSTITUTABLE_USERNAME_RE.fullmatch(username) for username in usernames
+    ):
+        return [
+            template.render({**template_params, "recipient_username": username})
+            for username in usernames
+        ]
+
+    # The placeholder is random so that it can't be matched by any event content.
+    placeholder = f"recipient-{secrets.token_hex(16)}"
+    html, text = template.render({**template_params, "recipient_username": placeholder})
+    return [
+        (html.replace(placeholder, username), text.replace(placeholder, username))
+        for username in usernames
+    ]
+
+
 class MailBatch:
     """Creates several outgoing emails from a single Phabricator event.
 
@@ -42,6 +81,25 @@ class MailBatch:
         self._targets = {}
         self._template_store = template_store
 
+    def __len__(self):
+        """The number of emails that will be created for the current event."""
+        return len(self._targets)
+
+    def _target(self, recipient: Optional[Recipient], template_path: str, kwargs):
+        if not recipient or recipient.is_actor:
+            return
+
+        if recipient.email in self._targets:
+            return
+
+        self._targets[recipient.email] = Target(
+            template_path,
+            recipient.email,
+            recipient.username,
+            recipient.timezone,
+            kwargs,
+        )
+
     def target(self, recipient: Optional[Recipient], template_path: str, **kwargs):
         """Appends another email to be sent for the current event.
 
@@ -53,16 +111,7 @@ class MailBatch:
         the same recipient multiple times are ignored (the first template + args are
         used).
         """
-        if not recipient or recipient.is_actor:
-            return
-
-        if recipient.email in self._targets:
-            return
-
-        kwargs["recipient_timezone"] = recipient.timezone
-        self._targets[recipient.email] = Target(
-            template_path, recipient.email, recipient.username, kwargs
-        )
+        self._target(recipient, template_path, kwargs)
 
     def target_many(self, recipients: list[Recipient], template_path: str, **kwargs):
         """Appends many emails to be sent for the current event.
@@ -70,22 +119,65 @@ class MailBatch:
         Each email will use the provided template (rendered with the extra kwargs
         parameters). This email will be sent to all provided recipients.
         """
+        # The recipients share the same "kwargs" dictionary, which lets their emails
+        # be rendered together.
         for recipient in recipients:
-            self.target(recipient, template_path, **kwargs)
+            self._target(recipient, template_path, kwargs)
+
+    def _templates(self, path_prefix: str) -> dict[str, Template]:
+        """Look up each distinct template used by the targets, keyed by its path.
+
+        Most targets of an event share the same few templates, so each is only
+        fetched from the template store once.
+        """
+        template_paths = dict.fromkeys(
+            target.template_path for target in self._targets.values()
+        )
+        return {
+            template_path: self._template_store.get(path_prefix + template_path)
+            for template_path in template_paths
+        }
+
+    def _render(self, path_prefix: str, template_params: dict):
+        """Render the html and text email for each target, keyed by recipient email.
+
+        Targets that only differ by recipient username (same template, same extra
+        parameters and same timezone) share a single render of their template.
+        """
+        templates = self._templates(path_prefix)
+        groups: dict[tuple[str, int, timezone], list[Target]] = {}
+        for target in self._targets.values():
+            key = (target.template_path, id(target.kwargs), target.recipient_timezone)
+            groups.setdefault(key, []).append(target)
+
+        rendered = {}
+        for (template_path, _, recipient_timezone), targets in groups.items():
+            group_params = {
+                **template_params,
+                **targets[0].kwargs,
+                "recipient_timezone": recipient_timezone,
+            }
+            contents = render_for_usernames(
+                templates[template_path],
+                group_params,
+                [target.recipient_username for target in targets],
+            )
+            for target, target_contents in zip(targets, contents):
+                rendered[target.recipient_email] = target_contents
+        return rendered
 
     def _process(
         self,
         subject: str,
         template_path: str,
+        contents: tuple[str, str],
         recipient_address: str,
         timestamp: int,
         actor: Actor,
         revision_id: int,
-        template_params: dict,
     ):
-        """Render the provided template and parameters into an OutgoingEmail."""
-        template = self._template_store.get(template_path)
-        html_email, text_email = template.render(template_params)
+        """Wrap the rendered html and text contents into an OutgoingEmail."""
+        html_email, text_email = contents
         return OutgoingEmail(
             template_path,
             subject,
@@ -106,24 +198,27 @@ class MailBatch:
         event,
     ) -> list[OutgoingEmail]:
         """Process all targets with the provided public event parameters."""
+        rendered = self._render(
+            PUBLIC_TEMPLATE_PATH_PREFIX,
+            {
+                "revision": revision,
+                "actor_name": actor.user_name,
+                "unique_number": unique_number,
+                "event": event,
+            },
+        )
+        # The email subject identifies the revision by monogram. So, for the
+        # revision D2, the subject is: "D2: <name>"
+        subject = f"D{revision.id}: {revision.name}"
         return [
             self._process(
-                # The email subject identifies the revision by monogram. So, for the
-                # revision D2, the subject is: "D2: <name>"
-                subject=f"D{revision.id}: {revision.name}",
+                subject=subject,
                 template_path=PUBLIC_TEMPLATE_PATH_PREFIX + target.template_path,
+                contents=rendered[target.recipient_email],
                 recipient_address=target.recipient_email,
                 actor=actor,
                 timestamp=timestamp,
                 revision_id=revision.id,
-                template_params={
-                    "revision": revision,
-                    "actor_name": actor.user_name,
-                    "recipient_username": target.recipient_username,
-                    "unique_number": unique_number,
-                    "event": event,
-                    **target.kwargs,
-                },
             )
             for target in self._targets.values()
         ]
@@ -137,25 +232,28 @@ class MailBatch:
         event,
     ) -> list[OutgoingEmail]:
         """Process all targets with the provided secure event parameters."""
+        rendered = self._render(
+            SECURE_TEMPLATE_PATH_PREFIX,
+            {
+                "revision": revision,
+                "actor_name": actor.user_name,
+                "unique_number": unique_number,
+                "event": event,
+            },
+        )
+        # For secure bugs, we obscure information that may identify the
+        # security issue. Since the revision name might leak such information,
+        # we just show the bug ID instead.
+        subject = f"D{revision.id}: (secure bug {revision.bug.id})"
         return [
             self._process(
-                # For secure bugs, we obscure information that may identify the
-                # security issue. Since the revision name might leak such information,
-                # we just show the bug ID instead.
-                subject=f"D{revision.id}: (secure bug {revision.bug.id})",
+                subject=subject,
                 template_path=SECURE_TEMPLATE_PATH_PREFIX + target.template_path,
+                contents=rendered[target.recipient_email],
                 recipient_address=target.recipient_email,
                 actor=actor,
                 timestamp=timestamp,
                 revision_id=revision.id,
-                template_params={
-                    "revision": revision,
-                    "actor_name": actor.user_name,
-                    "recipient_username": target.recipient_username,
-                    "unique_number": unique_number,
-                    "event": event,
-                    **target.kwargs,
-                },
             )
             for target in self._targets.values()
         ]
@@ -3,6 +3,7 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 from dataclasses import dataclass
+from typing import Any, Callable
 
 from phabricatoremails.mail import OutgoingEmail
 from phabricatoremails.render.events.common import ParseError, Recipient, Actor
@@ -37,8 +38,9 @@ from phabricatoremails.render.events.phabricator_secure import (
     SecureRevisionCreated,
     SecureRevisionClosed,
 )
-from phabricatoremails.render.mailbatch import MailBatch
+from phabricatoremails.render.mailbatch import MailBatch, render_for_usernames
 from phabricatoremails.render.template import TemplateStore
+from phabricatoremails.slots import slotted
 from phabricatoremails.thread_store import ThreadStore
 
 
@@ -60,132 +62,176 @@ def _is_legacy_revision_landed(kind: str, raw_body: dict):
     return kind == RevisionLanded.KIND and "transactionLink" in raw_body
 
 
-def parse_body(kind: str, is_secure: bool, raw_body: dict, batch: MailBatch):
-    if kind == RevisionAccepted.KIND:
-        if is_secure:
-            body = SecureRevisionAccepted.parse(raw_body)
-        else:
-            body = RevisionAccepted.parse(raw_body)
-
-        batch.target(body.author, "accepted-as-author")
-        batch.target_many(body.reviewers, "accepted")
-        batch.target_many(body.subscribers, "accepted")
-    elif kind == RevisionMetadataEdited.KIND:
-        # There's no "insecure" variant for when metadata is edited
-        body = RevisionMetadataEdited.parse(raw_body)
-
-        batch.target(body.author, "edited-metadata")
-        for reviewer in body.reviewers:
-            if reviewer.metadata_change == ExistenceChange.ADDED:
-                batch.target_many(
-                    reviewer.recipients, "added-as-reviewer", reviewer=reviewer
-                )
-            elif reviewer.metadata_change == ExistenceChange.REMOVED:
-                batch.target_many(reviewer.recipients, "removed-as-reviewer")
-            else:
-                batch.target_many(
-                    reviewer.recipients,
-                    "edited-metadata-as-reviewer",
-                    reviewer=reviewer,
-                )
-        batch.target_many(body.subscribers, "edited-metadata")
-    elif kind == RevisionCommented.KIND:
-        if is_secure:
-            body = SecureRevisionCommented.parse(raw_body)
-        else:
-            body = RevisionCommented.parse(raw_body)
+def _target_accepted(body, batch: MailBatch):
+    batch.target(body.author, "accepted-as-author")
+    batch.target_many(body.reviewers, "accepted")
+    batch.target_many(body.subscribers, "accepted")
 
-        batch.target(body.author, "commented")
-        batch.target_many(body.reviewers, "commented")
-        batch.target_many(body.subscribers, "commented")
-    elif kind == RevisionClosed.KIND or _is_legacy_revision_landed(kind, raw_body):
-        if is_secure:
-            body = SecureRevisionClosed.parse(raw_body)
-        else:
-            body = RevisionClosed.parse(raw_body)
-        batch.target(body.author, "closed")
-        batch.target_many(body.reviewers, "closed")
-        batch.target_many(body.subscribers, "closed")
-    elif kind == RevisionLanded.KIND:
-        if is_secure:
-            body = SecureRevisionLanded.parse(raw_body)
-        else:
-            body = RevisionLanded.parse(raw_body)
-        batch.target(body.author, "landed")
-        batch.target_many(body.reviewers, "landed")
-        batch.target_many(body.subscribers, "landed")
-    elif kind == RevisionCommentPinged.KIND:
-        if is_secure:
-            body = SecureRevisionCommentPinged.parse(raw_body)
-        else:
-            body = RevisionCommentPinged.parse(raw_body)
-        batch.target(body.recipient, "pinged")
-    elif kind == RevisionRequestedChanges.KIND:
-        if is_secure:
-            body = SecureRevisionRequestedChanges.parse(raw_body)
-        else:
-            body = RevisionRequestedChanges.parse(raw_body)
-
-        batch.target(body.author, "requested-changes-as-author")
-        batch.target_many(body.reviewers, "requested-changes")
-        batch.target_many(body.subscribers, "requested-changes")
-    elif kind == RevisionRequestedReview.KIND:
-        if is_secure:
-            body = SecureRevisionRequestedReview.parse(raw_body)
-        else:
-            body = RevisionRequestedReview.parse(raw_body)
 
-        for reviewer in body.reviewers:
+def _target_metadata_edited(body, batch: MailBatch):
+    batch.target(body.author, "edited-metadata")
+    for reviewer in body.reviewers:
+        if reviewer.metadata_change == ExistenceChange.ADDED:
             batch.target_many(
-                reviewer.recipients, "requested-review-as-reviewer", reviewer=reviewer
+                reviewer.recipients, "added-as-reviewer", reviewer=reviewer
             )
-        batch.target_many(body.subscribers, "requested-review")
-    elif kind == RevisionUpdated.KIND:
-        if is_secure:
-            body = SecureRevisionUpdated.parse(raw_body)
+        elif reviewer.metadata_change == ExistenceChange.REMOVED:
+            batch.target_many(reviewer.recipients, "removed-as-reviewer")
         else:
-            body = RevisionUpdated.parse(raw_body)
-
-        for reviewer in body.reviewers:
             batch.target_many(
-                reviewer.recipients, "updated-as-reviewer", reviewer=reviewer
+                reviewer.recipients,
+                "edited-metadata-as-reviewer",
+                reviewer=reviewer,
             )
-        batch.target_many(body.subscribers, "updated")
-    elif kind == RevisionAbandoned.KIND:
-        if is_secure:
-            body = SecureRevisionAbandoned.parse(raw_body)
-        else:
-            body = RevisionAbandoned.parse(raw_body)
-        batch.target_many(body.reviewers, "abandoned")
-        batch.target_many(body.subscribers, "abandoned")
-    elif kind == RevisionReclaimed.KIND:
-        if is_secure:
-            body = SecureRevisionReclaimed.parse(raw_body)
-        else:
-            body = RevisionReclaimed.parse(raw_body)
+    batch.target_many(body.subscribers, "edited-metadata")
 
-        for reviewer in body.reviewers:
-            batch.target_many(
-                reviewer.recipients, "reclaimed-as-reviewer", reviewer=reviewer
-            )
-        batch.target_many(body.subscribers, "reclaimed")
-    elif kind == RevisionCreated.KIND:
-        if is_secure:
-            body = SecureRevisionCreated.parse(raw_body)
-        else:
-            body = RevisionCreated.parse(raw_body)
 
-        for reviewer in body.reviewers:
-            batch.target_many(
-                reviewer.recipients, "created-as-reviewer", reviewer=reviewer
-            )
-        batch.target_many(body.subscribers, "created")
-    else:
+def _target_commented(body, batch: MailBatch):
+    batch.target(body.author, "commented")
+    batch.target_many(body.reviewers, "commented")
+    batch.target_many(body.subscribers, "commented")
+
+
+def _target_closed(body, batch: MailBatch):
+    batch.target(body.author, "closed")
+    batch.target_many(body.reviewers, "closed")
+    batch.target_many(body.subscribers, "closed")
+
+
+def _target_landed(body, batch: MailBatch):
+    batch.target(body.author, "landed")
+    batch.target_many(body.reviewers, "landed")
+    batch.target_many(body.subscribers, "landed")
+
+
+def _target_comment_pinged(body, batch: MailBatch):
+    batch.target(body.recipient, "pinged")
+
+
+def _target_requested_changes(body, batch: MailBatch):
+    batch.target(body.author, "requested-changes-as-author")
+    batch.target_many(body.reviewers, "requested-changes")
+    batch.target_many(body.subscribers, "requested-changes")
+
+
+def _target_requested_review(body, batch: MailBatch):
+    for reviewer in body.reviewers:
+        batch.target_many(
+            reviewer.recipients, "requested-review-as-reviewer", reviewer=reviewer
+        )
+    batch.target_many(body.subscribers, "requested-review")
+
+
+def _target_updated(body, batch: MailBatch):
+    for reviewer in body.reviewers:
+        batch.target_many(reviewer.recipients, "updated-as-reviewer", reviewer=reviewer)
+    batch.target_many(body.subscribers, "updated")
+
+
+def _target_abandoned(body, batch: MailBatch):
+    batch.target_many(body.reviewers, "abandoned")
+    batch.target_many(body.subscribers, "abandoned")
+
+
+def _target_reclaimed(body, batch: MailBatch):
+    for reviewer in body.reviewers:
+        batch.target_many(
+            reviewer.recipients, "reclaimed-as-reviewer", reviewer=reviewer
+        )
+    batch.target_many(body.subscribers, "reclaimed")
+
+
+def _target_created(body, batch: MailBatch):
+    for reviewer in body.reviewers:
+        batch.target_many(reviewer.recipients, "created-as-reviewer", reviewer=reviewer)
+    batch.target_many(body.subscribers, "created")
+
+
+_ParseBody = Callable[[dict], Any]
+_TargetRecipients = Callable[[Any, MailBatch], None]
+
+# For each event kind: the public body parser, the secure body parser, and the
+# function that targets the body's recipients.
+_EVENT_KINDS: dict[str, tuple[_ParseBody, _ParseBody, _TargetRecipients]] = {
+    RevisionAccepted.KIND: (
+        RevisionAccepted.parse,
+        SecureRevisionAccepted.parse,
+        _target_accepted,
+    ),
+    # There's no "insecure" variant for when metadata is edited
+    RevisionMetadataEdited.KIND: (
+        RevisionMetadataEdited.parse,
+        RevisionMetadataEdited.parse,
+        _target_metadata_edited,
+    ),
+    RevisionCommented.KIND: (
+        RevisionCommented.parse,
+        SecureRevisionCommented.parse,
+        _target_commented,
+    ),
+    RevisionClosed.KIND: (
+        RevisionClosed.parse,
+        SecureRevisionClosed.parse,
+        _target_closed,
+    ),
+    RevisionLanded.KIND: (
+        RevisionLanded.parse,
+        SecureRevisionLanded.parse,
+        _target_landed,
+    ),
+    RevisionCommentPinged.KIND: (
+        RevisionCommentPinged.parse,
+        SecureRevisionCommentPinged.parse,
+        _target_comment_pinged,
+    ),
+    RevisionRequestedChanges.KIND: (
+        RevisionRequestedChanges.parse,
+        SecureRevisionRequestedChanges.parse,
+        _target_requested_changes,
+    ),
+    RevisionRequestedReview.KIND: (
+        RevisionRequestedReview.parse,
+        SecureRevisionRequestedReview.parse,
+        _target_requested_review,
+    ),
+    RevisionUpdated.KIND: (
+        RevisionUpdated.parse,
+        SecureRevisionUpdated.parse,
+        _target_updated,
+    ),
+    RevisionAbandoned.KIND: (
+        RevisionAbandoned.parse,
+        SecureRevisionAbandoned.parse,
+        _target_abandoned,
+    ),
+    RevisionReclaimed.KIND: (
+        RevisionReclaimed.parse,
+        SecureRevisionReclaimed.parse,
+        _target_reclaimed,
+    ),
+    RevisionCreated.KIND: (
+        RevisionCreated.parse,
+        SecureRevisionCreated.parse,
+        _target_created,
+    ),
+}
+
+
+def parse_body(kind: str, is_secure: bool, raw_body: dict, batch: MailBatch):
+    if _is_legacy_revision_landed(kind, raw_body):
+        kind = RevisionClosed.KIND
+
+    event_kind = _EVENT_KINDS.get(kind)
+    if event_kind is None:
         raise ParseError(f"Unexpected revision event kind: {kind}")
 
+    parse_public, parse_secure, target = event_kind
+    body = (parse_secure if is_secure else parse_public)(raw_body)
+    target(body, batch)
     return body
 
 
+@slotted
 @dataclass
 class Render:
     """Transform a raw Phabricator event into the emails it triggers."""
@@ -197,8 +243,13 @@ class Render:
     ) -> list[OutgoingEmail]:
         """Turn the raw Phabricator context into outgoing emails."""
         batch = MailBatch(self._template_store)
-        actor = Actor.parse(context["actor"])
         body = parse_body(context["eventKind"], is_secure, context["body"], batch)
+        if not batch:
+            # Only the actor was notified, so the actor and revision don't need to be
+            # parsed, and there's no email thread to create or continue.
+            return []
+
+        actor = Actor.parse(context["actor"])
         if is_secure:
             revision = SecureRevision.parse(context["revision"])
             thread = thread_store.get_or_create(revision.id)
@@ -227,32 +278,37 @@ class Render:
     ):
         """Turn the minimal Phabricator context into outgoing emails."""
         revision = MinimalRevision.parse(context["revision"])
-        recipients = Recipient.parse_many(context["recipients"])
+        recipients = [
+            recipient
+            for recipient in Recipient.parse_many(context["recipients"])
+            if not recipient.is_actor
+        ]
+        if not recipients:
+            # Only the actor was notified, so there's no email to send, and no email
+            # thread to create or continue.
+            return []
+
         thread = thread_store.get_or_create(revision.id)
         thread.email_count += 1
-        emails = []
-        for recipient in recipients:
-            if recipient.is_actor:
-                continue
-
-            template = self._template_store.get("minimal")
-            html_email, text_email = template.render(
-                {
-                    "revision": revision,
-                    "recipient_username": recipient.username,
-                    "unique_number": thread.email_count,
-                    "event": context,
-                }
-            )
-            emails.append(
-                OutgoingEmail(
-                    "minimal",
-                    f"D{revision.id}",
-                    recipient.email,
-                    timestamp,
-                    revision.id,
-                    html_email,
-                    text_email,
-                )
+        contents = render_for_usernames(
+            self._template_store.get("minimal"),
+            {
+                "revision": revision,
+                "unique_number": thread.email_count,
+                "event": context,
+            },
+            [recipient.username for recipient in recipients],
+        )
+        subject = f"D{revision.id}"
+        return [
+            OutgoingEmail(
+                "minimal",
+                subject,
+                recipient.email,
+                timestamp,
+                revision.id,
+                html_email,
+                text_email,
             )
-        return emails
+            for recipient, (html_email, text_email) in zip(recipients, contents)
+        ]
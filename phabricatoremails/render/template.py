@@ -2,6 +2,7 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import functools
 import textwrap
 from dataclasses import dataclass
 from datetime import datetime, timezone
@@ -16,6 +17,7 @@ from phabricatoremails.render.events.phabricator import (
     AffectedFileChange,
     ExistenceChange,
 )
+from phabricatoremails.slots import slotted
 from premailer import Premailer
 
 _DATE_WITH_TIMEZONE_FORMAT = "%b %-d %-I:%M%p"
@@ -37,9 +39,12 @@ EMOJI = {
     "wrench": 0x1F527,
 }
 
+# The HTML character references are built once, rather than on every emoji render
+_EMOJI_HTML = {name: f"&#{code_point};" for name, code_point in EMOJI.items()}
+
 
 def _emoji_html(key: str):
-    return f"&#{EMOJI[key]};"
+    return _EMOJI_HTML[key]
 
 
 def _is_reply(context):
@@ -84,7 +89,10 @@ def _reviewer_actionable_class(reviewer: Reviewer):
     return "actionable" if reviewer.is_actionable else "non-actionable"
 
 
+@functools.lru_cache(maxsize=4096)
 def _date(utc_value: datetime, receiver_timezone: timezone):
+    # Emails of an event share the same few timestamps and their recipients share a
+    # small set of timezones, so most dates have already been formatted.
     return utc_value.astimezone(receiver_timezone).strftime(_DATE_WITH_TIMEZONE_FORMAT)
 
 
@@ -108,86 +116,92 @@ def _secure_comment_summary(body):
         return " and submitted comments"
 
 
+# The filters below are called per diff line or per reviewer, so they map each enum
+# member with a dictionary lookup rather than comparing it against every member.
+_DIFF_CLASSES = {
+    DiffLineType.ADDED: "added-line",
+    DiffLineType.REMOVED: "removed-line",
+    DiffLineType.NO_CHANGE: "no-change-line",
+}
+_DIFF_SYMBOLS = {
+    DiffLineType.ADDED: "+",
+    DiffLineType.REMOVED: "-",
+    DiffLineType.NO_CHANGE: "",
+}
+_REVIEWER_STATUS_ICONS = {
+    ReviewerStatus.ACCEPTED: _emoji_html("check_mark"),
+    ReviewerStatus.REQUESTED_CHANGES: _emoji_html("deny_x"),
+}
+_EXISTENCE_CHANGES = {
+    ExistenceChange.NO_CHANGE: "",
+    ExistenceChange.ADDED: "added",
+    ExistenceChange.REMOVED: "removed",
+}
+_FILE_CHANGES = {
+    AffectedFileChange.MODIFIED: "modified",
+    AffectedFileChange.ADDED: "added",
+    AffectedFileChange.REMOVED: "removed",
+}
+_TEXT_REVIEWER_STATUSES = {
+    ReviewerStatus.ACCEPTED: "(r+) ",
+    ReviewerStatus.REQUESTED_CHANGES: "(r-) ",
+}
+_TEXT_EXISTENCE_CHANGES = {
+    ExistenceChange.ADDED: "(added)",
+    ExistenceChange.REMOVED: "(removed)",
+}
+
+
 def _diff_class(diff_type: DiffLineType):
-    if diff_type == DiffLineType.ADDED:
-        return "added-line"
-    elif diff_type == DiffLineType.REMOVED:
-        return "removed-line"
-    elif diff_type == DiffLineType.NO_CHANGE:
-        return "no-change-line"
+    return _DIFF_CLASSES[diff_type]
 
 
 def _reviewer_status_icon(status: ReviewerStatus):
-    if status == ReviewerStatus.ACCEPTED:
-        return _emoji_html("check_mark")
-    elif status == ReviewerStatus.REQUESTED_CHANGES:
-        return _emoji_html("deny_x")
-    else:
-        return ""
+    return _REVIEWER_STATUS_ICONS.get(status, "")
 
 
 def _existence_change(reviewer_change: ExistenceChange):
-    if reviewer_change == ExistenceChange.NO_CHANGE:
-        return ""
-    elif reviewer_change == ExistenceChange.ADDED:
-        return "added"
-    elif reviewer_change == ExistenceChange.REMOVED:
-        return "removed"
+    return _EXISTENCE_CHANGES[reviewer_change]
 
 
 def _file_change(change: AffectedFileChange):
-    if change == AffectedFileChange.MODIFIED:
-        return "modified"
-    elif change == AffectedFileChange.ADDED:
-        return "added"
-    elif change == AffectedFileChange.REMOVED:
-        return "removed"
+    return _FILE_CHANGES[change]
 
 
 def _diff_symbol(diff_type: DiffLineType):
-    if diff_type == DiffLineType.ADDED:
-        return "+"
-    elif diff_type == DiffLineType.REMOVED:
-        return "-"
-    elif diff_type == DiffLineType.NO_CHANGE:
-        return ""
+    return _DIFF_SYMBOLS[diff_type]
+
+
+# Email width is 80, use two characters for "> ". So, each line gets 78 characters.
+# The wrapper is shared, rather than "textwrap.wrap()" setting up a new one per line.
+_COMMENT_WRAPPER = textwrap.TextWrapper(78)
 
 
 def _text_comment(comment: str):
+    wrap = _COMMENT_WRAPPER.wrap
     return "\n".join(
         [
             "> " + line
             for raw_line in comment.strip().split("\n")
-            # Email width is 80, use two characters for "> ". So, each line gets 78
-            # characters. If line is empty, manually return [""] to preserve the empty
-            # line.
-            for line in (textwrap.wrap(raw_line, 78) if raw_line else [""])
+            # If line is empty, manually return [""] to preserve the empty line.
+            for line in (wrap(raw_line) if raw_line else [""])
         ]
     )
 
 
 def _text_reviewer_status(status: ReviewerStatus):
-    if status == ReviewerStatus.ACCEPTED:
-        return "(r+) "
-    elif status == ReviewerStatus.REQUESTED_CHANGES:
-        return "(r-) "
-    else:
-        return ""
+    return _TEXT_REVIEWER_STATUSES.get(status, "")
 
 
 def _text_existence_change(change: ExistenceChange):
-    if change == ExistenceChange.ADDED:
-        return "(added)"
-    elif change == ExistenceChange.REMOVED:
-        return "(removed)"
-    else:
-        return ""
+    return _TEXT_EXISTENCE_CHANGES.get(change, "")
 
 
 def _remove_newlines(markup):
     return " ".join(markup.splitlines())
 
 
+@slotted
 @dataclass
 class Template:
     """Renders the raw HTML and text Jinja templates.
@@ -202,8 +216,11 @@ class Template:
     _text_template: jinja2.Template
 
     def render(self, template_params: dict):
-        html = self._html_template.render(**template_params)
-        text = self._text_template.render(**template_params)
+        # The parameters are passed as a mapping rather than unpacked as keyword
+        # arguments, so they aren't copied an extra time before Jinja builds the
+        # render context from them.
+        html = self._html_template.render(template_params)
+        text = self._text_template.render(template_params)
 
         return self._css_inline.transform(html, False), text
 
@@ -237,27 +254,47 @@ class JinjaTemplateStore:
             allow_network=False,
             strip_important=False,
         )
-        self.html_jinja_env = _jinja_html(
-            html_loader
+        self.html_jinja_env = (
+            _jinja_html(html_loader, phabricator_host)
             if html_loader
-            else jinja2.PackageLoader("phabricatoremails", "render/templates/html"),
-            phabricator_host,
+            else _package_jinja_html(phabricator_host)
         )
-        self.text_jinja_env = _jinja_text(
-            text_loader
+        self.text_jinja_env = (
+            _jinja_text(text_loader, phabricator_host)
             if text_loader
-            else jinja2.PackageLoader("phabricatoremails", "render/templates/text"),
-            phabricator_host,
+            else _package_jinja_text(phabricator_host)
         )
+        # Templates aren't reloaded at runtime, so each is only looked up once.
+        self._templates: dict[str, Template] = {}
 
     def get(self, template_path: str) -> Template:
         """Return html and text templates from the "templates" directory."""
 
-        return Template(
-            self._css_inline,
-            self.html_jinja_env.get_template(f"{template_path}.html.jinja2"),
-            self.text_jinja_env.get_template(f"{template_path}.text.jinja2"),
-        )
+        template = self._templates.get(template_path)
+        if template is None:
+            template = Template(
+                self._css_inline,
+                self.html_jinja_env.get_template(f"{template_path}.html.jinja2"),
+                self.text_jinja_env.get_template(f"{template_path}.text.jinja2"),
+            )
+            self._templates[template_path] = template
+        return template
+
+    def preload(self):
+        """Compile every email template up-front.
+
+        Otherwise, each template is compiled the first time an event needs it,
+        which slows down sending those emails. This also ensures that each html
+        template has its text counterpart. Macros ("_macros") and templates that are
+        only extended by others (".base") aren't emails, so they're skipped.
+        """
+        for name in self.html_jinja_env.list_templates(extensions=["jinja2"]):
+            template_path = name.removesuffix(".html.jinja2")
+            if template_path == name or template_path.endswith(".base"):
+                continue
+            if template_path.rpartition("/")[2].startswith("_"):
+                continue
+            self.get(template_path)
 
 
 def _jinja_html(loader, phabricator_host: str):
@@ -318,3 +355,21 @@ def _jinja_text(loader, phabricator_host: str):
     jinja_env.filters["secure_comment_summary"] = _secure_comment_summary
     jinja_env.globals["phabricator_host"] = phabricator_host
     return jinja_env
+
+
+# The packaged templates don't change at runtime, so stores for the same Phabricator
+# host share their Jinja environments (and the templates compiled by them).
+@functools.lru_cache(maxsize=None)
+def _package_jinja_html(phabricator_host: str):
+    return _jinja_html(
+        jinja2.PackageLoader("phabricatoremails", "render/templates/html"),
+        phabricator_host,
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def _package_jinja_text(phabricator_host: str):
+    return _jinja_text(
+        jinja2.PackageLoader("phabricatoremails", "render/templates/text"),
+        phabricator_host,
+    )
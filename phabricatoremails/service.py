@@ -2,11 +2,15 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 import enum
+import functools
 import time
+import traceback
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
 from dataclasses import dataclass, field
 from enum import Enum
 from logging import Logger
-from typing import List, Optional
+from typing import List, Optional, Tuple
 
 import jinja2
 import sentry_sdk
@@ -25,12 +29,17 @@ from phabricatoremails.mail import FsMail, SendEmailState, OutgoingEmail, Mail
 from phabricatoremails.render.render import Render
 from phabricatoremails.render.template import JinjaTemplateStore
 from phabricatoremails.settings import Settings
+from phabricatoremails.slots import slotted
 from phabricatoremails.source import PhabricatorException, Source
 from phabricatoremails.thread_store import ThreadStore
 from statsd import StatsClient
 
 
 _RENDER_EXCEPTIONS = (LookupError, TypeError, ValueError, jinja2.TemplateError)
+# Sentry groups repeated errors anyway, so when the same kind of error happens again
+# shortly afterwards (e.g. for every email while the email provider is down), it isn't
+# re-sent. It's still logged and counted in statsd each time.
+_SENTRY_DUPLICATE_WINDOW_SECONDS = 60
 
 
 class ProcessEventState(Enum):
@@ -39,6 +48,7 @@ class ProcessEventState(Enum):
     FAILED_TO_RENDER = enum.auto()
 
 
+@slotted
 @dataclass
 class ProcessEventResult:
     state: ProcessEventState
@@ -46,47 +56,124 @@ class ProcessEventResult:
     failed_to_send_recipients: List[str] = field(default_factory=list)
 
 
-def _report_render_failure(logger: Logger, e: Exception):
+class BufferedStats:
+    """Tallies statsd counters in-process until they're flushed.
+
+    Failures tend to happen in bursts (such as when the email provider is having
+    an outage), which would otherwise send the same counter to statsd over and over.
+    Instead, increments are summed per-stat, and each stat is sent once on flush.
+
+    Flushes happen after each event and before waiting to retry emails, so counters
+    still reach statsd while a long outage keeps the pipeline from returning.
+    """
+
+    _counts: Counter[str]
+
+    def __init__(self, stats: StatsClient):
+        self._counts = Counter()
+        self._stats = stats
+
+    def incr(self, stat: str, count: int = 1):
+        self._counts[stat] += count
+
+    def flush(self):
+        """Send all tallied counters to statsd in a single batch."""
+        if not self._counts:
+            return
+
+        with self._stats.pipeline() as pipeline:
+            for stat, count in self._counts.items():
+                pipeline.incr(stat, count)
+        self._counts.clear()
+
+
+def _raised_from(e: Exception):
+    """Return the file and line that raised the error, if it was raised."""
+    frames = traceback.extract_tb(e.__traceback__)
+    if not frames:
+        return None
+    return frames[-1].filename, frames[-1].lineno
+
+
+class SentryReporter:
+    """Reports errors to Sentry, skipping kinds of errors that were recently reported.
+
+    Errors are keyed by their type, the statsd counter of the failure they caused and
+    the line that raised them (rather than by their message, which usually contains
+    event-specific details). So, different bugs that raise the same type of error
+    are still each reported. Only errors from within the duplicate window are
+    remembered.
+    """
+
+    _last_captures: dict[tuple[type, str, Optional[tuple[str, int]]], float]
+
+    def __init__(self):
+        self._last_captures = {}
+
+    def capture(self, e: Exception, failure_stat: str):
+        now = time.monotonic()
+        self._last_captures = {
+            key: last_capture
+            for key, last_capture in self._last_captures.items()
+            if now - last_capture < _SENTRY_DUPLICATE_WINDOW_SECONDS
+        }
+        key = (type(e), failure_stat, _raised_from(e))
+        if key in self._last_captures:
+            return
+
+        self._last_captures[key] = now
+        sentry_sdk.capture_exception(e)
+
+
+def _report_render_failure(
+    logger: Logger, sentry: SentryReporter, e: Exception, failure_stat: str
+):
     logger.warning(render_exception(e))
-    sentry_sdk.capture_exception(e)
+    sentry.capture(e, failure_stat)
 
 
 def _send_emails(
     mail,
-    stats: StatsClient,
+    stats: BufferedStats,
+    sentry: SentryReporter,
     logger: Logger,
     emails: List[OutgoingEmail],
     retry_delay_seconds: int,
+    failure_stat: str,
 ) -> List[str]:
     """Attempt to send emails, retrying if necessary.
 
+    The emails are handed to the mailer as a batch. Any that temporarily failed are
+    re-sent together after waiting for "retry_delay_seconds".
+
     Returns list of recipient email addresses who had an email that failed to be sent
-    to them.
+    to them. Those failures are counted by the caller as "failure_stat".
     """
 
     failed_recipients = []
-    for email in emails:
-        while True:
-            result = mail.send(email)
+    while emails:
+        retry_emails = []
+        for email, result in zip(emails, mail.send_many(emails)):
             if result.status == SendEmailState.TEMPORARY_FAILURE:
                 stats.incr(STAT_FAILED_TO_SEND_MAIL_TEMPORARY)
                 logger.warning(
-                    'Encountered temporary failure while sending email: "{}"'.format(
-                        result.reason_text
-                    )
+                    'Encountered temporary failure while sending email: "%s"',
+                    result.reason_text,
                 )
-
-                # "Temporary failures" can be anything from a transient network glitch
-                # to something as serious and long-lived as Amazon pausing our
-                # ability to send emails.
-                logger.warning("Sleeping for {} seconds".format(retry_delay_seconds))
-                time.sleep(retry_delay_seconds)
-                continue  # retry sending this email
+                retry_emails.append(email)
             elif result.status == SendEmailState.PERMANENT_FAILURE:
                 logger.warning(render_exception(result.exception))
-                sentry_sdk.capture_exception(result.exception)
+                sentry.capture(result.exception, failure_stat)
                 failed_recipients.append(email.to)
-            break
+
+        if retry_emails:
+            # "Temporary failures" can be anything from a transient network glitch
+            # to something as serious and long-lived as Amazon pausing our
+            # ability to send emails.
+            logger.warning("Sleeping for %s seconds", retry_delay_seconds)
+            stats.flush()
+            time.sleep(retry_delay_seconds)
+        emails = retry_emails  # retry sending the emails that temporarily failed
 
     return failed_recipients
 
@@ -97,7 +184,8 @@ def process_emails_full(
     context: dict,
     render: Render,
     thread_store: ThreadStore,
-    stats: StatsClient,
+    stats: BufferedStats,
+    sentry: SentryReporter,
     logger: Logger,
     retry_delay_seconds: int,
     mail,
@@ -113,15 +201,19 @@ def process_emails_full(
             is_secure, timestamp, context, thread_store
         )
     except _RENDER_EXCEPTIONS as e:
-        _report_render_failure(logger, e)
+        _report_render_failure(
+            logger, sentry, e, STAT_FAILED_TO_RENDER_FULL_CONTEXT_EVENT
+        )
         return ProcessEventResult(ProcessEventState.FAILED_TO_RENDER, 0)
 
     permanent_send_failure_recipients = _send_emails(
         mail,
         stats,
+        sentry,
         logger,
         emails,
         retry_delay_seconds,
+        STAT_FAILED_TO_SEND_FULL_CONTEXT_MAIL,
     )
     if permanent_send_failure_recipients:
         return ProcessEventResult(
@@ -138,7 +230,8 @@ def process_events_minimal(
     minimal_context: dict,
     render: Render,
     thread_store: ThreadStore,
-    stats: StatsClient,
+    stats: BufferedStats,
+    sentry: SentryReporter,
     logger: Logger,
     retry_delay_seconds: int,
     filter_recipients: Optional[list[str]],
@@ -155,7 +248,9 @@ def process_events_minimal(
             timestamp, minimal_context, thread_store
         )
     except _RENDER_EXCEPTIONS as e:
-        _report_render_failure(logger, e)
+        _report_render_failure(
+            logger, sentry, e, STAT_FAILED_TO_RENDER_MINIMAL_CONTEXT_EVENT
+        )
         return ProcessEventResult(ProcessEventState.FAILED_TO_RENDER, 0)
 
     if filter_recipients is not None:
@@ -166,9 +261,11 @@ def process_events_minimal(
     permanent_send_failure_recipients = _send_emails(
         mail,
         stats,
+        sentry,
         logger,
         emails,
         retry_delay_seconds,
+        STAT_FAILED_TO_SEND_MINIMAL_CONTEXT_MAIL,
     )
     if permanent_send_failure_recipients:
         return ProcessEventResult(
@@ -185,7 +282,8 @@ def process_event(
     thread_store: ThreadStore,
     logger: Logger,
     retry_delay_seconds: int,
-    stats: StatsClient,
+    stats: BufferedStats,
+    sentry: SentryReporter,
     mail,
 ) -> int:
     """Reliably send emails for the provided event.
@@ -220,6 +318,7 @@ def process_event(
             render,
             thread_store,
             stats,
+            sentry,
             logger,
             retry_delay_seconds,
             mail,
@@ -253,6 +352,7 @@ def process_event(
         render,
         thread_store,
         stats,
+        sentry,
         logger,
         retry_delay_seconds,
         recipient_filter_list,
@@ -280,6 +380,21 @@ def process_event(
     )
 
 
+def _event_revision_ids(events: List[dict]):
+    """Return the ids of the revisions that the events are about.
+
+    Malformed events are skipped here, they're reported when they fail to render.
+    """
+    revision_ids = set()
+    for event in events:
+        for context_key in ("context", "minimalContext"):
+            try:
+                revision_ids.add(event[context_key]["revision"]["revisionId"])
+            except (LookupError, TypeError):
+                pass
+    return revision_ids
+
+
 @dataclass
 class Pipeline:
     """Fetch events from Phabricator and emails accordingly."""
@@ -291,44 +406,109 @@ class Pipeline:
     _retry_delay_seconds: int
     _stats: StatsClient
     _is_dev: bool
+    # The next page of the feed, keyed by the position that it was fetched from
+    _prefetched: Optional[Tuple[int, Future]] = field(
+        default=None, init=False, repr=False
+    )
+    _prefetch_executor: ThreadPoolExecutor = field(
+        default_factory=lambda: ThreadPoolExecutor(max_workers=1),
+        init=False,
+        repr=False,
+    )
+    _sentry: SentryReporter = field(
+        default_factory=SentryReporter, init=False, repr=False
+    )
+
+    def close(self):
+        """Stop prefetching pages of the feed.
+
+        A prefetch that's still in progress is abandoned rather than waited for.
+        """
+        prefetched, self._prefetched = self._prefetched, None
+        if prefetched:
+            prefetched[1].cancel()
+        self._prefetch_executor.shutdown(wait=False, cancel_futures=True)
+
+    def _fetch_next(self, from_key: int):
+        """Fetch the feed after "from_key", using the prefetched page if it matches."""
+        prefetched, self._prefetched = self._prefetched, None
+        if prefetched and prefetched[0] == from_key:
+            result = prefetched[1].result()
+            # The page was fetched before the previous page's emails were sent. If it
+            # was empty, then events may have been published since, so the feed is
+            # fetched again rather than reporting that it's caught up (which would
+            # delay those events by the polling delay).
+            if result["data"]["events"]:
+                return result
+        return self._source.fetch_next(from_key)
 
     def run(self, thread_store: ThreadStore, from_key: int):
-        """Query Phabricator feed and send email, returning new feed position."""
+        """Query Phabricator feed and send email, returning new feed position.
 
+        Statistics recorded during the run are tallied in-process and sent together
+        (rather than as one UDP packet each) after each event, and once the run ends.
+        """
+
+        stats = BufferedStats(self._stats)
+        try:
+            return self._run(thread_store, from_key, stats)
+        finally:
+            stats.flush()
+
+    def _run(self, thread_store: ThreadStore, from_key: int, stats: BufferedStats):
         try:
-            result = self._source.fetch_next(from_key)
+            result = self._fetch_next(from_key)
         except PhabricatorException as e:
             self._logger.warning(e)
             self._logger.warning(
                 "Failed to fetch data from Phabricator. Ignoring the error,"
                 "will retry after the polling delay."
             )
-            self._stats.incr(STAT_FAILED_TO_REQUEST_FROM_PHABRICATOR)
+            stats.incr(STAT_FAILED_TO_REQUEST_FROM_PHABRICATOR)
             return from_key
 
         story_error_count = result["data"]["storyErrors"]
         if self._is_dev and story_error_count:
             self._logger.error(
-                "Server encountered {} errors while creating email events".format(
-                    story_error_count
-                )
+                "Server encountered %s errors while creating email events",
+                story_error_count,
+            )
+
+        events = result["data"]["events"]
+        next_key = int(result["cursor"]["after"])
+        if events and next_key != from_key:
+            # More events are likely to follow, so the next page is requested in the
+            # background while the emails for this page are rendered and sent.
+            self._prefetched = (
+                next_key,
+                self._prefetch_executor.submit(self._source.fetch_next, next_key),
             )
 
+        thread_store.preload(_event_revision_ids(events))
+
         email_count = 0
-        for event in result["data"]["events"]:
+        for event in events:
             email_count += process_event(
                 event,
                 self._render,
                 thread_store,
                 self._logger,
                 self._retry_delay_seconds,
-                self._stats,
+                stats,
+                self._sentry,
                 self._mail,
             )
+            stats.flush()
 
         if self._is_dev:
-            self._logger.debug(f"Sent {email_count} emails.")
-        return int(result["cursor"]["after"])
+            self._logger.debug("Sent %s emails.", email_count)
+        return next_key
+
+
+@functools.lru_cache(maxsize=1)
+def _css_text():
+    """Return the stylesheet that is inlined into html emails."""
+    return (PACKAGE_DIRECTORY / "render/templates/html/style.css").read_text()
 
 
 def service(settings: Settings, stats: StatsClient):
@@ -353,15 +533,14 @@ def service(settings: Settings, stats: StatsClient):
             "`phabricator-emails prepare` first."
         )
 
-    raw_css_path = PACKAGE_DIRECTORY / "render/templates/html/style.css"
-    css_text = raw_css_path.read_text()
     template_store = JinjaTemplateStore(
         settings.phabricator_host,
-        css_text,
+        _css_text(),
         # Keep CSS classes when outputting to local files, since that indicates local
         # development/testing
         keep_css_classes=isinstance(mail, FsMail),
     )
+    template_store.preload()
 
     render = Render(template_store)
     pipeline = Pipeline(
@@ -373,4 +552,8 @@ def service(settings: Settings, stats: StatsClient):
         stats,
         settings.is_dev,
     )
-    worker.process(db, pipeline.run)
+    try:
+        worker.process(db, pipeline.run)
+    finally:
+        pipeline.close()
+        mail.close()
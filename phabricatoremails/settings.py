@@ -13,13 +13,22 @@ from typing import Protocol
 from phabricatoremails import PACKAGE_DIRECTORY
 from phabricatoremails.db import DB
 from phabricatoremails.logging import create_dev_logger, create_logger
-from phabricatoremails.mail import SesMail, SmtpMail, FsMail, Mail
+from phabricatoremails.mail import (
+    SES_DEFAULT_MAX_CONCURRENT_SENDS,
+    SesMail,
+    SmtpMail,
+    FsMail,
+    Mail,
+)
 from phabricatoremails.worker import RunOnceWorker, PhabricatorWorker, Worker
 from phabricatoremails.source import FileSource, PhabricatorSource, Source
 from sqlalchemy import create_engine
 
 
 SETTINGS_PATH_ENV_KEY = "PHABRICATOR_EMAILS_SETTINGS_PATH"
+# Replace pooled database connections after this long, before the server (or a proxy
+# in front of it) drops them for being idle.
+DB_POOL_RECYCLE_SECONDS = 1800
 
 
 def _parse_logger(is_dev: bool):
@@ -79,6 +88,13 @@ def _parse_mail(config: ConfigParser, logger: Logger):
             "email-ses", "aws_secret_access_key", fallback=None
         )
         aws_session_token = config.get("email-ses", "aws_session_token", fallback=None)
+        max_concurrent_sends = int(
+            config.get(
+                "email-ses",
+                "max_concurrent_sends",
+                fallback=SES_DEFAULT_MAX_CONCURRENT_SENDS,
+            )
+        )
         return SesMail.from_aws_credentials(
             from_address,
             logger,
@@ -86,13 +102,14 @@ def _parse_mail(config: ConfigParser, logger: Logger):
             aws_access_key_id,
             aws_secret_access_key,
             aws_session_token,
+            max_concurrent_sends,
         )
 
     if implementation == "smtp":
         host = config.get("email-smtp", "host")
         send_to = config.get("email-smtp", "send_to", fallback=None)
         mail_server = smtplib.SMTP(host, timeout=1)
-        return SmtpMail(mail_server, from_address, logger, send_to)
+        return SmtpMail(mail_server, from_address, logger, send_to, host)
 
     if implementation == "fs":
         output = config.get("email-fs", "output_path", fallback="output")
@@ -154,7 +171,12 @@ class IniSettings:
         self._config = config
 
     def db(self):
-        return DB(create_engine(self.db_url))
+        engine = create_engine(
+            self.db_url,
+            pool_pre_ping=True,
+            pool_recycle=DB_POOL_RECYCLE_SECONDS,
+        )
+        return DB(engine)
 
     def mail(self):
         return _parse_mail(self._config, self.logger)
@@ -2,33 +2,62 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
-from dataclasses import dataclass
-from typing import Protocol
+from dataclasses import dataclass, field
+from typing import Iterable, Protocol
 
 from phabricatoremails.models import Thread
 from sqlalchemy.orm import Session
 
 
 class ThreadStore(Protocol):
+    def preload(self, revision_ids: Iterable[int]):
+        """Fetch the threads of many revisions at once, ahead of "get_or_create()"."""
+        pass
+
     def get_or_create(self, revision_id: int) -> Thread:
         pass
 
 
 @dataclass
 class DBThreadStore:
-    """Perform operations on the Thread table."""
+    """Perform operations on the Thread table.
+
+    Threads are remembered once they've been fetched or created, so that a batch
+    of events can look up all of their threads with a single preloading query.
+    """
 
     _db_session: Session
+    _threads: dict[int, Thread] = field(default_factory=dict)
+    # Revisions that were preloaded, but didn't have a thread yet
+    _missing_revision_ids: set[int] = field(default_factory=set)
 
-    def get_or_create(self, revision_id):
-        existing_thread = (
-            self._db_session.query(Thread)
-            .filter_by(phabricator_revision_id=revision_id)
-            .one_or_none()
+    def preload(self, revision_ids):
+        revision_ids = set(revision_ids).difference(self._threads)
+        if not revision_ids:
+            return
+
+        threads = self._db_session.query(Thread).filter(
+            Thread.phabricator_revision_id.in_(revision_ids)
         )
-        if existing_thread:
-            return existing_thread
+        for thread in threads:
+            self._threads[thread.phabricator_revision_id] = thread
+        self._missing_revision_ids.update(revision_ids.difference(self._threads))
 
-        new_thread = Thread(phabricator_revision_id=revision_id, email_count=0)
-        self._db_session.add(new_thread)
-        return new_thread
+    def get_or_create(self, revision_id):
+        thread = self._threads.get(revision_id)
+        if thread:
+            return thread
+
+        if revision_id in self._missing_revision_ids:
+            thread = None
+        else:
+            thread = (
+                self._db_session.query(Thread)
+                .filter_by(phabricator_revision_id=revision_id)
+                .one_or_none()
+            )
+        if not thread:
+            thread = Thread(phabricator_revision_id=revision_id, email_count=0)
+            self._db_session.add(thread)
+        self._threads[revision_id] = thread
+        return thread
@@ -60,11 +60,11 @@ class PhabricatorWorker:
     ):
         """Invoke the pipeline, return True if there's no new events."""
 
-        query_position = query_position_store.get_position()
-        last_key = pipeline(thread_store, query_position.up_to_key)
+        position_key = query_position_store.get_position_key()
+        last_key = pipeline(thread_store, position_key)
 
-        if query_position.up_to_key != last_key:
-            query_position.up_to_key = last_key
+        if position_key != last_key:
+            query_position_store.advance_position(last_key)
             return False
         else:
             return True
@@ -87,6 +87,9 @@ class PhabricatorWorker:
         signal.signal(signal.SIGTERM, self._on_shutdown_signal)
 
         while not self._is_shutdown_requested:
+            # All events from a poll share one session (and so, one transaction).
+            # It's committed before sleeping so that the connection isn't left idle
+            # in an open transaction for the duration of the poll gap.
             with db.session() as db_session:
                 is_caught_up = self._poll(
                     DBQueryPositionStore(db_session),
@@ -94,19 +97,19 @@ class PhabricatorWorker:
                     pipeline,
                 )
 
-                if is_caught_up and not self._is_shutdown_requested:
-                    if self._is_dev:
-                        self._logger.debug(
-                            f"Caught up with feed, sleeping for "
-                            f"{self._poll_gap_seconds} seconds..."
-                        )
-
-                    self._is_sleeping = True
-                    try:
-                        time.sleep(self._poll_gap_seconds)
-                    except InterruptedError:
-                        pass
-                    self._is_sleeping = False
+            if is_caught_up and not self._is_shutdown_requested:
+                if self._is_dev:
+                    self._logger.debug(
+                        f"Caught up with feed, sleeping for "
+                        f"{self._poll_gap_seconds} seconds..."
+                    )
+
+                self._is_sleeping = True
+                try:
+                    time.sleep(self._poll_gap_seconds)
+                except InterruptedError:
+                    pass
+                self._is_sleeping = False
 
     @staticmethod
     def set_initial_position(store: QueryPositionStore, position: int):
@@ -8,3 +8,9 @@ from phabricatoremails.mail import SendEmailState, SendEmailResult
 class MockMail:
     def send(self, _):
         return SendEmailResult(SendEmailState.SUCCESS)
+
+    def send_many(self, emails):
+        return [self.send(email) for email in emails]
+
+    def close(self):
+        pass
@@ -2,15 +2,16 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
-from phabricatoremails.models import QueryPosition
-
 
 class MockQueryPositionStore:
-    def __init__(self, *, position: QueryPosition):
-        self._position = position
+    def __init__(self, *, position_key: int):
+        self.position_key = position_key
+
+    def get_position_key(self):
+        return self.position_key
 
-    def get_position(self):
-        return self._position
+    def advance_position(self, position_key):
+        self.position_key = position_key
 
     def set_initial_position(self, query_position_store):
         raise NotImplementedError()
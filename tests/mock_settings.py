@@ -4,6 +4,8 @@
 
 import logging
 
+from tests.mock_mail import MockMail
+
 
 class MockSettings:
     def __init__(
@@ -30,7 +32,7 @@ class MockSettings:
         self.is_dev = is_dev
         self.temporary_mail_error_retry_seconds = temporary_mail_error_retry_seconds
         self._db = db
-        self._mail = mail
+        self._mail = mail if mail is not None else MockMail()
 
     def db(self):
         return self._db
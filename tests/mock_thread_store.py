@@ -8,6 +8,10 @@ from phabricatoremails.models import Thread
 class MockThreadStore:
     def __init__(self):
         self._threads = {}
+        self.preloaded_revision_ids = set()
+
+    def preload(self, revision_ids):
+        self.preloaded_revision_ids.update(revision_ids)
 
     def get_or_create(self, revision_id):
         if self._threads.get(revision_id):
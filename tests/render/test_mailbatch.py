@@ -3,7 +3,9 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 from datetime import timezone
+from unittest.mock import Mock
 
+from kgb import spy_on
 from phabricatoremails.render.events.common import Recipient, Actor
 from phabricatoremails.render.events.phabricator import Revision, RevisionCreated
 from phabricatoremails.render.events.phabricator_secure import SecureRevision, SecureBug
@@ -133,6 +135,61 @@ def test_passes_arguments_to_template():
     assert store.last_template_params()["extra_template_param"] == "value"
 
 
+def test_fetches_each_template_once():
+    store = MockTemplateStore()
+    batch = MailBatch(store)
+    batch.target(Recipient("1@mail", "1", timezone.utc, False), "template-author")
+    batch.target_many(
+        [
+            Recipient("2@mail", "2", timezone.utc, False),
+            Recipient("3@mail", "3", timezone.utc, False),
+        ],
+        "template-reviewer",
+    )
+    with spy_on(store.get) as get_spy:
+        emails = batch.process(PUBLIC_REVISION, ACTOR, 0, 0, EVENT)
+        assert len(emails) == 3
+        assert [call.args[0] for call in get_spy.calls] == [
+            PUBLIC_TEMPLATE_PATH_PREFIX + "template-author",
+            PUBLIC_TEMPLATE_PATH_PREFIX + "template-reviewer",
+        ]
+
+
+class UsernameTemplate:
+    def __init__(self):
+        self.render_count = 0
+
+    def render(self, params):
+        self.render_count += 1
+        username = params["recipient_username"]
+        return f"<a>{username}</a>", f"text {username}"
+
+
+def test_renders_recipients_sharing_a_template_once():
+    template = UsernameTemplate()
+    store = Mock()
+    store.get.return_value = template
+    batch = MailBatch(store)
+    batch.target_many(
+        [
+            Recipient("1@mail", "user-1", timezone.utc, False),
+            Recipient("2@mail", "user.2", timezone.utc, False),
+        ],
+        "template-reviewer",
+    )
+    batch.target(
+        Recipient("3@mail", "user_3", timezone.utc, False), "template-reviewer"
+    )
+    emails = batch.process(PUBLIC_REVISION, ACTOR, 0, 0, EVENT)
+    # The first two recipients were targeted together, the third separately.
+    assert template.render_count == 2
+    assert [(email.html_contents, email.text_contents) for email in emails] == [
+        ("<a>user-1</a>", "text user-1"),
+        ("<a>user.2</a>", "text user.2"),
+        ("<a>user_3</a>", "text user_3"),
+    ]
+
+
 def test_dont_override_target():
     batch = MailBatch(MockTemplateStore())
     batch.target(NON_ACTOR_RECIPIENT, "template-author")
@@ -2,8 +2,19 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
-from phabricatoremails.render.events.phabricator import RevisionUpdated
-from phabricatoremails.render.render import Render
+from unittest.mock import Mock
+
+import pytest
+
+from phabricatoremails.render.events.common import Actor, ParseError
+from phabricatoremails.render.events.phabricator import (
+    Revision,
+    RevisionClosed,
+    RevisionLanded,
+    RevisionUpdated,
+)
+from phabricatoremails.render.mailbatch import MailBatch
+from phabricatoremails.render.render import Render, parse_body
 from tests.mock_thread_store import MockThreadStore
 from tests.render.mock_template import MockTemplateStore
 
@@ -114,6 +125,80 @@ def test_processes_minimal_events():
     assert email.to == "reviewer@mail"
 
 
+def test_renders_minimal_template_once_for_all_recipients():
+    template = Mock()
+    template.render.side_effect = lambda params: (
+        f"html {params['recipient_username']}",
+        f"text {params['recipient_username']}",
+    )
+    template_store = Mock()
+    template_store.get.return_value = template
+    context = _create_minimal_context(1)
+    context["recipients"].append(
+        {
+            "email": "other@mail",
+            "username": "other",
+            "timezoneOffset": 0,
+            "isActor": False,
+        }
+    )
+    emails = Render(template_store).process_event_to_emails_with_minimal_context(
+        123, context, MockThreadStore()
+    )
+    assert template.render.call_count == 1
+    assert [
+        (email.to, email.html_contents, email.text_contents) for email in emails
+    ] == [
+        ("reviewer@mail", "html reviewer", "text reviewer"),
+        ("other@mail", "html other", "text other"),
+    ]
+
+
+def test_minimal_event_for_only_the_actor_doesnt_touch_thread():
+    template_store = Mock()
+    thread_store = Mock()
+    context = _create_minimal_context(1)
+    context["recipients"][0]["isActor"] = True
+    emails = Render(template_store).process_event_to_emails_with_minimal_context(
+        123, context, thread_store
+    )
+    assert emails == []
+    assert not thread_store.get_or_create.called
+    assert not template_store.get.called
+
+
+def test_full_event_for_only_the_actor_doesnt_touch_thread():
+    thread_store = Mock()
+    context = _create_public_context(1)
+    context["body"] = {
+        "isReadyToLand": True,
+        "newChangesLink": "link",
+        "affectedFiles": [],
+        "subscribers": [],
+        "reviewers": [
+            {
+                "name": "actor",
+                "isActionable": True,
+                "status": "requested-changes",
+                "recipients": [
+                    {
+                        "timezoneOffset": -25200,
+                        "username": "actor",
+                        "email": "actor@mail",
+                        "isActor": True,
+                    }
+                ],
+            }
+        ],
+    }
+    del context["revision"]
+    emails = Render(MockTemplateStore()).process_event_to_emails_with_full_context(
+        False, 123, context, thread_store
+    )
+    assert emails == []
+    assert not thread_store.get_or_create.called
+
+
 def test_unique_number_is_different_for_each_thread_email():
     template_store = MockTemplateStore()
     render = Render(template_store)
@@ -132,3 +217,31 @@ def test_unique_number_is_different_for_each_thread_email():
         False, 123, _create_public_context(2), thread_store
     )
     assert template_store.last_template_params()["unique_number"] == 1
+
+
+def test_parse_body_rejects_unknown_kind():
+    with pytest.raises(ParseError):
+        parse_body("revision-unknown", False, {}, MailBatch(MockTemplateStore()))
+
+
+def test_parse_body_treats_legacy_landed_as_closed():
+    template_store = MockTemplateStore()
+    batch = MailBatch(template_store)
+    raw_body = {
+        "inlineComments": [],
+        "transactionLink": "link",
+        "reviewers": [
+            {
+                "timezoneOffset": 0,
+                "username": "reviewer",
+                "email": "reviewer@mail",
+                "isActor": False,
+            }
+        ],
+        "subscribers": [],
+    }
+    body = parse_body(RevisionLanded.KIND, False, raw_body, batch)
+    assert isinstance(body, RevisionClosed)
+    revision = Revision(1, "revision", "link", "repo", None)
+    batch.process(revision, Actor("actor", "actor"), 0, 0, body)
+    assert template_store.last_template_path() == "public/closed"
@@ -24,6 +24,7 @@ from phabricatoremails.render.mailbatch import PUBLIC_TEMPLATE_PATH_PREFIX
 from phabricatoremails.render.template import (
     JinjaTemplateStore,
     Template,
+    _date,
     _jinja_html,
     _jinja_text,
 )
@@ -78,6 +79,40 @@ def test_template_throws_error_if_invalid_template():
         template_store.get(PUBLIC_TEMPLATE_PATH_PREFIX + "invalid")
 
 
+def test_template_is_only_looked_up_once():
+    template_store = JinjaTemplateStore(
+        "",
+        "",
+        False,
+        DictLoader({"example.html.jinja2": ""}),
+        DictLoader({"example.text.jinja2": ""}),
+    )
+    assert template_store.get("example") is template_store.get("example")
+
+
+def test_preload_compiles_each_email_template():
+    template_store = JinjaTemplateStore(
+        "",
+        "",
+        False,
+        DictLoader(
+            {
+                "_macros.html.jinja2": "",
+                "minimal.html.jinja2": "",
+                "public/edited.base.html.jinja2": "",
+                "public/edited.html.jinja2": "",
+            }
+        ),
+        DictLoader({"minimal.text.jinja2": "", "public/edited.text.jinja2": ""}),
+    )
+    template_store.preload()
+    assert list(template_store._templates) == ["minimal", "public/edited"]
+
+
+def test_preload_packaged_templates():
+    JinjaTemplateStore("", "", False).preload()
+
+
 def test_template_is_rendered_with_parameters():
     jinja_env = jinja2.Environment(
         loader=DictLoader(
@@ -93,6 +128,15 @@ def test_template_is_rendered_with_parameters():
     assert text == "hello world"
 
 
+def test_stores_for_the_same_host_share_jinja_environments():
+    store = JinjaTemplateStore("phabricator.test", "", False)
+    other_store = JinjaTemplateStore("phabricator.test", "", True)
+    assert store.html_jinja_env is other_store.html_jinja_env
+    assert store.text_jinja_env is other_store.text_jinja_env
+    other_host_store = JinjaTemplateStore("other.test", "", False)
+    assert store.html_jinja_env is not other_host_store.html_jinja_env
+
+
 def test_css_is_inlined():
     template_store = JinjaTemplateStore(
         "",
@@ -157,3 +201,13 @@ def test_text_environment():
         "This is to test that wrapping\n"
         "> happens correctly when rendered down to text."
     )
+
+
+def test_date_is_formatted_once_per_timestamp_and_timezone():
+    date = datetime.fromtimestamp(10000, timezone.utc)
+    receiver_timezone = timezone(timedelta(hours=-7))
+    _date.cache_clear()
+    assert _date(date, receiver_timezone) == "Dec 31 7:46PM"
+    assert _date(date, timezone(timedelta(hours=-7))) == "Dec 31 7:46PM"
+    assert _date(date, timezone.utc) == "Jan 1 2:46AM"
+    assert _date.cache_info().hits == 1
@@ -2,11 +2,19 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import email
+import smtplib
+import socket
+from email.header import decode_header, make_header
 from unittest import mock
 from unittest.mock import Mock
 
+import pytest
+from botocore.exceptions import ClientError, NoCredentialsError
+from kgb import spy_on
 from phabricatoremails import logging
 from phabricatoremails.mail import (
+    FsMail,
     SmtpMail,
     OutgoingEmail,
     SesMail,
@@ -25,6 +33,27 @@ MOCK_EMAIL = OutgoingEmail(
 )
 
 
+def test_fs(tmp_path):
+    mail = FsMail("from@mail", logging.create_dev_logger(), tmp_path)
+    result = mail.send(MOCK_EMAIL)
+    assert result == SendEmailResult(SendEmailState.SUCCESS)
+    assert "phabricator subject" in (tmp_path / "eml" / "0-to-to@mail.eml").read_text()
+    assert (tmp_path / "html" / "0-to-to@mail.html").read_text() == "summary in html"
+    assert (tmp_path / "text" / "0-to-to@mail.text").read_text() == "summary in text"
+
+
+def test_fs_send_many(tmp_path):
+    mail = FsMail("from@mail", logging.create_dev_logger(), tmp_path)
+    emails = [
+        OutgoingEmail("template", "subject", f"{i}@mail", 0, 1, f"html {i}", "text")
+        for i in range(5)
+    ]
+    results = mail.send_many(emails)
+    assert results == [SendEmailResult(SendEmailState.SUCCESS)] * 5
+    for i in range(5):
+        assert (tmp_path / "html" / f"{i}-to-{i}@mail.html").read_text() == f"html {i}"
+
+
 def test_smtp():
     smtp_server = Mock()
     mail = SmtpMail(smtp_server, "from@mail", logging.create_dev_logger(), None)
@@ -36,9 +65,53 @@ def test_smtp():
         mock.ANY,
     )
     mime_message = smtp_server.sendmail.call_args.args[2]
-    assert "phabricator subject" in mime_message
-    assert "summary in html" in mime_message
-    assert "summary in text" in mime_message
+    assert b"phabricator subject" in mime_message
+    assert b"summary in html" in mime_message
+    assert b"summary in text" in mime_message
+    # "smtplib" doesn't fix the line endings of messages passed as bytes.
+    assert b"\n" not in mime_message.replace(b"\r\n", b"")
+
+
+def test_smtp_reconnects_when_disconnected():
+    smtp_server = Mock()
+    smtp_server.sendmail.side_effect = [smtplib.SMTPServerDisconnected(), {}]
+    mail = SmtpMail(
+        smtp_server, "from@mail", logging.create_dev_logger(), None, "smtp-host"
+    )
+    result = mail.send(MOCK_EMAIL)
+    assert result == SendEmailResult(SendEmailState.SUCCESS)
+    smtp_server.connect.assert_called_once_with("smtp-host")
+    smtp_server.ehlo.assert_called_once()
+    assert smtp_server.sendmail.call_count == 2
+
+
+def test_smtp_disconnected_is_temporary_failure():
+    smtp_server = Mock()
+    smtp_server.sendmail.side_effect = smtplib.SMTPServerDisconnected()
+    mail = SmtpMail(smtp_server, "from@mail", logging.create_dev_logger(), None)
+    result = mail.send(MOCK_EMAIL)
+    assert result.status == SendEmailState.TEMPORARY_FAILURE
+    assert result.reason_text == "SMTPServerDisconnected"
+
+
+def test_smtp_reconnect_timeout_is_temporary_failure():
+    smtp_server = Mock()
+    smtp_server.sendmail.side_effect = smtplib.SMTPServerDisconnected()
+    smtp_server.connect.side_effect = socket.timeout()
+    mail = SmtpMail(
+        smtp_server, "from@mail", logging.create_dev_logger(), None, "smtp-host"
+    )
+    result = mail.send(MOCK_EMAIL)
+    assert result.status == SendEmailState.TEMPORARY_FAILURE
+    assert result.reason_text == "timeout"
+
+
+def test_smtp_rejected_email_is_raised():
+    smtp_server = Mock()
+    smtp_server.sendmail.side_effect = smtplib.SMTPRecipientsRefused({})
+    mail = SmtpMail(smtp_server, "from@mail", logging.create_dev_logger(), None)
+    with pytest.raises(smtplib.SMTPRecipientsRefused):
+        mail.send(MOCK_EMAIL)
 
 
 def test_ses():
@@ -49,6 +122,122 @@ def test_ses():
     ses_kwargs = client.send_raw_email.call_args.kwargs
     assert ses_kwargs["Destinations"] == ["to@mail"]
     assert ses_kwargs["Source"] == "from@mail"
-    assert "phabricator subject" in ses_kwargs["RawMessage"]["Data"]
-    assert "summary in html" in ses_kwargs["RawMessage"]["Data"]
-    assert "summary in text" in ses_kwargs["RawMessage"]["Data"]
+    assert b"phabricator subject" in ses_kwargs["RawMessage"]["Data"]
+    assert b"summary in html" in ses_kwargs["RawMessage"]["Data"]
+    assert b"summary in text" in ses_kwargs["RawMessage"]["Data"]
+
+
+def test_ses_send_many_preserves_order():
+    def send_raw_email(Destinations, **_):
+        if Destinations == ["3@mail"]:
+            raise ClientError({"Error": {"Code": "Throttling"}}, "SendRawEmail")
+
+    client = Mock()
+    client.send_raw_email.side_effect = send_raw_email
+    mail = SesMail(client, "from@mail", logging.create_dev_logger(), None)
+    emails = [
+        OutgoingEmail("template", "subject", f"{i}@mail", 0, 1, "html", "text")
+        for i in range(10)
+    ]
+    results = mail.send_many(emails)
+    assert client.send_raw_email.call_count == 10
+    assert [result.status for result in results] == [SendEmailState.SUCCESS] * 3 + [
+        SendEmailState.TEMPORARY_FAILURE
+    ] + [SendEmailState.SUCCESS] * 6
+    assert results[3].reason_text == "Throttling"
+    mail.close()
+
+
+def test_ses_send_many_reuses_threads_until_closed():
+    client = Mock()
+    mail = SesMail(client, "from@mail", logging.create_dev_logger(), None)
+    emails = [MOCK_EMAIL, MOCK_EMAIL]
+    mail.send_many(emails)
+    executor = mail._executor
+    mail.send_many(emails)
+    assert mail._executor is executor
+    assert client.send_raw_email.call_count == 4
+
+    mail.close()
+    assert mail._executor is None
+
+
+def test_ses_send_many_raises_unexpected_errors():
+    def send_raw_email(Destinations, **_):
+        if Destinations == ["3@mail"]:
+            raise NoCredentialsError()
+
+    client = Mock()
+    client.send_raw_email.side_effect = send_raw_email
+    mail = SesMail(client, "from@mail", logging.create_dev_logger(), None)
+    emails = [
+        OutgoingEmail("template", "subject", f"{i}@mail", 0, 1, "html", "text")
+        for i in range(10)
+    ]
+    with pytest.raises(NoCredentialsError):
+        mail.send_many(emails)
+    mail.close()
+
+
+@mock.patch("boto3.client")
+def test_ses_client_is_created_on_first_send(boto3_client):
+    mail = SesMail.from_aws_credentials("from@mail", logging.create_dev_logger(), None)
+    boto3_client.assert_not_called()
+    mail.send(MOCK_EMAIL)
+    mail.send(MOCK_EMAIL)
+    boto3_client.assert_called_once()
+    assert boto3_client.call_args.kwargs["config"].retries == {
+        "max_attempts": 5,
+        "mode": "standard",
+    }
+    assert boto3_client.call_args.kwargs["config"].max_pool_connections == 4
+    assert boto3_client.return_value.send_raw_email.call_count == 2
+
+
+def test_mime_bytes_are_cached():
+    outgoing = OutgoingEmail(
+        "template", "subject", "to@mail", 0, 1, "html contents", "text contents"
+    )
+    with spy_on(OutgoingEmail.to_raw_message, owner=OutgoingEmail) as spy:
+        first = outgoing.to_mime_bytes("from@mail")
+        second = outgoing.to_mime_bytes("from@mail")
+        assert first == second
+        assert len(spy.calls) == 1
+
+        targeted = outgoing.to_mime_bytes("from@mail", include_target_in_subject=True)
+        assert b"|to@mail| subject" in targeted
+        assert len(spy.calls) == 2
+        # Only the headers differ, the encoded body is shared.
+        assert targeted.split(b"\n\n", 1)[1] == first.split(b"\n\n", 1)[1]
+
+
+def test_raw_message_is_valid_mime():
+    outgoing = OutgoingEmail(
+        "template", "sübject", "to@mail", 0, 1, "<p>hélló</p>", "plain text"
+    )
+    message = email.message_from_string(outgoing.to_raw_message("from@mail"))
+    assert message.get_content_type() == "multipart/alternative"
+    assert str(make_header(decode_header(message["Subject"]))) == "sübject"
+    text, html = message.get_payload()
+    assert text.get_content_type() == "text/plain"
+    assert (
+        text.get_payload(decode=True).decode(text.get_content_charset()) == "plain text"
+    )
+    assert html.get_content_type() == "text/html"
+    assert html.get_payload(decode=True).decode("utf-8") == "<p>hélló</p>"
+
+
+def test_threading_headers():
+    outgoing = OutgoingEmail("template", "subject", "to@mail", 1600000000, 12, "", "")
+    headers = outgoing._generate_threading_headers("mozilla.com")
+    assert headers["Thread-Topic"] == "revision-12"
+    # The Thread-Index must stay stable across releases, otherwise Outlook will
+    # no longer group new emails with the existing ones for each revision.
+    assert headers["Thread-Index"] == "Yzk2ZjgzYWU1NDQ4NmRiMzE0ZjNiOGQ0NmU5IF9eEAA="
+    assert headers["In-Reply-To"] == "<revision-12@mozilla.com>"
+    assert headers["References"] == "<revision-12@mozilla.com>"
+
+
+def test_email_objects_use_slots():
+    assert not hasattr(MOCK_EMAIL, "__dict__")
+    assert not hasattr(SendEmailResult(SendEmailState.SUCCESS), "__dict__")
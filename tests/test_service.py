@@ -2,11 +2,16 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
-from unittest.mock import Mock, patch
+import threading
+from unittest.mock import MagicMock, Mock, patch
 
 import pytest
 from kgb import spy_on
 from phabricatoremails import logging
+from phabricatoremails.constants import (
+    STAT_FAILED_TO_REQUEST_FROM_PHABRICATOR,
+    STAT_FAILED_TO_SEND_MAIL_TEMPORARY,
+)
 from phabricatoremails.db import DBNotInitializedError
 from phabricatoremails.mail import (
     OutgoingEmail,
@@ -16,7 +21,15 @@ from phabricatoremails.mail import (
 )
 from phabricatoremails.render.render import Render
 from phabricatoremails.render.template import JinjaTemplateStore
-from phabricatoremails.service import Pipeline, service, process_event, _send_emails
+from phabricatoremails.service import (
+    BufferedStats,
+    Pipeline,
+    service,
+    process_event,
+    SentryReporter,
+    _SENTRY_DUPLICATE_WINDOW_SECONDS,
+    _send_emails,
+)
 from tests.mock_db import MockDB
 from tests.mock_mail import MockMail
 from tests.mock_settings import MockSettings
@@ -156,10 +169,12 @@ def test_integration_pipeline():
     mail = MockMail()
     render = Render(JinjaTemplateStore("", "", False))
     logger = logging.create_dev_logger()
-    pipeline = Pipeline(source, render, mail, logger, 0, Mock(), False)
+    pipeline = Pipeline(source, render, mail, logger, 0, MagicMock(), False)
+    thread_store = MockThreadStore()
     with spy_on(mail.send) as send_spy, spy_on(source.fetch_next) as fetch_spy:
-        new_position = pipeline.run(MockThreadStore(), 10)
+        new_position = pipeline.run(thread_store, 10)
         assert new_position == 20
+        assert thread_store.preloaded_revision_ids == {1, 2}
         assert fetch_spy.calls[0].args[0] == 10
 
         emails = []
@@ -186,14 +201,132 @@ def test_integration_pipeline():
     )
 
 
+def test_pipeline_prefetches_next_page():
+    page = {
+        "data": {
+            "storyErrors": 0,
+            "events": [{"timestamp": 0, "isSecure": False, "minimalContext": {}}],
+        },
+        "cursor": {"after": 20},
+    }
+    source = MockSource(next_result=page)
+    render = Mock()
+    render.process_event_to_emails_with_minimal_context.return_value = []
+    pipeline = Pipeline(
+        source, render, MockMail(), logging.create_dev_logger(), 0, MagicMock(), False
+    )
+    with spy_on(source.fetch_next) as fetch_spy:
+        assert pipeline.run(MockThreadStore(), 10) == 20
+        # The page after "20" was fetched in the background by the previous run, so
+        # it isn't requested again.
+        assert pipeline.run(MockThreadStore(), 20) == 20
+        pipeline.close()
+        assert [call.args[0] for call in fetch_spy.calls] == [10, 20]
+
+
+def test_pipeline_refetches_if_prefetched_page_is_empty():
+    def page(events, after):
+        return {
+            "data": {"storyErrors": 0, "events": events},
+            "cursor": {"after": after},
+        }
+
+    event = {"timestamp": 0, "isSecure": False, "minimalContext": {}}
+
+    class PublishingSource(MockSource):
+        def __init__(self):
+            super().__init__()
+            self.results = [
+                page([event], 20),
+                # Prefetched before the event below was published
+                page([], 20),
+                page([event], 30),
+            ]
+
+        def fetch_next(self, position):
+            return self.results.pop(0) if self.results else page([], position)
+
+    source = PublishingSource()
+    render = Mock()
+    render.process_event_to_emails_with_minimal_context.return_value = []
+    pipeline = Pipeline(
+        source, render, MockMail(), logging.create_dev_logger(), 0, MagicMock(), False
+    )
+    assert pipeline.run(MockThreadStore(), 10) == 20
+    assert pipeline.run(MockThreadStore(), 20) == 30
+    pipeline.close()
+    assert render.process_event_to_emails_with_minimal_context.call_count == 2
+
+
+def test_pipeline_close_doesnt_wait_for_prefetch():
+    class SlowSource(MockSource):
+        def __init__(self, **kwargs):
+            super().__init__(**kwargs)
+            self.release = threading.Event()
+            self.prefetch_finished = False
+
+        def fetch_next(self, position):
+            if position == 20:
+                self.release.wait(timeout=5)
+                self.prefetch_finished = True
+            return super().fetch_next(position)
+
+    page = {
+        "data": {
+            "storyErrors": 0,
+            "events": [{"timestamp": 0, "isSecure": False, "minimalContext": {}}],
+        },
+        "cursor": {"after": 20},
+    }
+    source = SlowSource(next_result=page)
+    render = Mock()
+    render.process_event_to_emails_with_minimal_context.return_value = []
+    pipeline = Pipeline(
+        source, render, MockMail(), logging.create_dev_logger(), 0, MagicMock(), False
+    )
+    assert pipeline.run(MockThreadStore(), 10) == 20
+    pipeline.close()
+    assert not source.prefetch_finished
+    source.release.set()
+
+
 def test_pipeline_returns_same_position_if_fetch_fails():
     source = MockSource(fail_on_fetch_next=True)
     pipeline = Pipeline(
-        source, Mock(), Mock(), logging.create_dev_logger(), 0, Mock(), False
+        source, Mock(), Mock(), logging.create_dev_logger(), 0, MagicMock(), False
     )
     assert pipeline.run(MockThreadStore(), 10) == 10
 
 
+def test_pipeline_sends_stats_through_statsd_pipeline():
+    source = MockSource(fail_on_fetch_next=True)
+    stats = MagicMock()
+    pipeline = Pipeline(
+        source, Mock(), Mock(), logging.create_dev_logger(), 0, stats, False
+    )
+    pipeline.run(MockThreadStore(), 10)
+    stats.incr.assert_not_called()
+    stats_pipeline = stats.pipeline.return_value.__enter__.return_value
+    stats_pipeline.incr.assert_called_with(STAT_FAILED_TO_REQUEST_FROM_PHABRICATOR, 1)
+
+
+def test_buffered_stats_aggregates_counters():
+    stats = MagicMock()
+    buffered_stats = BufferedStats(stats)
+    buffered_stats.incr("first")
+    buffered_stats.incr("first")
+    buffered_stats.incr("second", 3)
+    buffered_stats.flush()
+
+    stats_pipeline = stats.pipeline.return_value.__enter__.return_value
+    assert stats_pipeline.incr.call_count == 2
+    stats_pipeline.incr.assert_any_call("first", 2)
+    stats_pipeline.incr.assert_any_call("second", 3)
+
+    buffered_stats.flush()
+    assert stats_pipeline.incr.call_count == 2
+
+
 def test_pipeline_updates_position_even_if_no_new_events():
     # Sometimes, a feed event may happen that isn't relevant to emails. Phabricator
     # will report a newer feed position while returning an empty event list.
@@ -201,7 +334,7 @@ def test_pipeline_updates_position_even_if_no_new_events():
         next_result={"data": {"events": [], "storyErrors": 0}, "cursor": {"after": 20}}
     )
     logger = logging.create_dev_logger()
-    pipeline = Pipeline(source, Mock(), MockMail(), logger, 0, Mock(), False)
+    pipeline = Pipeline(source, Mock(), MockMail(), logger, 0, MagicMock(), False)
     new_position = pipeline.run(MockThreadStore(), 10)
     assert new_position == 20
 
@@ -230,7 +363,7 @@ def test_processes_with_minimal_context_if_no_full_context():
     render = Render(JinjaTemplateStore("", "", False))
     logger = logging.create_dev_logger()
     with spy_on(mail.send) as spy:
-        process_event(event, render, MockThreadStore(), logger, 0, Mock(), mail)
+        process_event(event, render, MockThreadStore(), logger, 0, Mock(), Mock(), mail)
         assert len(spy.calls) == 1
         assert spy.calls[0].args[0].template_path == "minimal"
 
@@ -261,7 +394,7 @@ def test_processes_with_minimal_context_if_full_context_error():
     render = Render(JinjaTemplateStore("", "", False))
     logger = logging.create_dev_logger()
     with spy_on(mail.send) as spy:
-        process_event(event, render, MockThreadStore(), logger, 0, Mock(), mail)
+        process_event(event, render, MockThreadStore(), logger, 0, Mock(), Mock(), mail)
         assert len(spy.calls) == 1
         assert spy.calls[0].args[0].template_path == "minimal"
 
@@ -331,11 +464,11 @@ def test_retries_failed_full_sends_with_minimal_emails(send_emails_fn):
     send_emails_fn.side_effect = [["2@mail"], []]
     render = Render(JinjaTemplateStore("", "", False))
     logger = logging.create_dev_logger()
-    process_event(event, render, MockThreadStore(), logger, 0, Mock(), None)
+    process_event(event, render, MockThreadStore(), logger, 0, Mock(), Mock(), None)
     assert len(send_emails_fn.call_args_list) == 2
-    assert len(send_emails_fn.call_args_list[1][0][3]) == 1
+    assert len(send_emails_fn.call_args_list[1][0][4]) == 1
     _assert_mail(
-        send_emails_fn.call_args_list[1][0][3][0],
+        send_emails_fn.call_args_list[1][0][4][0],
         "D1",
         "2@mail",
         "An (unknown) action occurred",
@@ -354,24 +487,108 @@ def test_retries_temporary_email_failures(_):
                 return SendEmailResult(SendEmailState.TEMPORARY_FAILURE, "oops")
             return SendEmailResult(SendEmailState.SUCCESS)
 
+        def send_many(self, emails):
+            return [self.send(email) for email in emails]
+
     mail = FailOnceMail()
     _send_emails(
         mail,
         Mock(),
+        Mock(),
         logging.create_dev_logger(),
         [OutgoingEmail("", "", "", 0, 1, "", "")],
         0,
+        "failure-stat",
     )
     _send_emails(
         mail,
         Mock(),
+        Mock(),
         logging.create_dev_logger(),
         [OutgoingEmail("", "", "", 1, 1, "", "")],
         0,
+        "failure-stat",
     )
     assert mail.call_count == 3
 
 
+def test_temporary_failures_are_sent_to_statsd_before_retrying():
+    class FailThriceMail:
+        def __init__(self):
+            self.call_count = 0
+
+        def send_many(self, emails):
+            self.call_count += 1
+            if self.call_count <= 3:
+                return [
+                    SendEmailResult(SendEmailState.TEMPORARY_FAILURE, "Throttling")
+                    for _ in emails
+                ]
+            return [SendEmailResult(SendEmailState.SUCCESS) for _ in emails]
+
+    stats = MagicMock()
+    stats_pipeline = stats.pipeline.return_value.__enter__.return_value
+    sent_before_each_sleep = []
+    with patch(
+        "time.sleep",
+        side_effect=lambda _: sent_before_each_sleep.append(
+            stats_pipeline.incr.call_count
+        ),
+    ):
+        _send_emails(
+            FailThriceMail(),
+            BufferedStats(stats),
+            Mock(),
+            logging.create_dev_logger(),
+            [OutgoingEmail("", "", "", 0, 1, "", "")],
+            0,
+            "failure-stat",
+        )
+    assert sent_before_each_sleep == [1, 2, 3]
+    stats_pipeline.incr.assert_called_with(STAT_FAILED_TO_SEND_MAIL_TEMPORARY, 1)
+
+
+def _raised(raise_fn):
+    try:
+        raise_fn()
+    except Exception as e:
+        return e
+    raise AssertionError("Expected an exception to be raised")
+
+
+@patch("sentry_sdk.capture_exception")
+def test_doesnt_capture_duplicate_exceptions_to_sentry(capture_exception_fn):
+    sentry = SentryReporter()
+    # Raised by the same line, but with different messages
+    for key in ("actor", "revision"):
+        sentry.capture(_raised(lambda: int(key)), "render")
+    assert capture_exception_fn.call_count == 1
+
+    sentry.capture(_raised(lambda: int("actor")), "send")
+    sentry.capture(TypeError("actor"), "render")
+    assert capture_exception_fn.call_count == 3
+
+
+@patch("sentry_sdk.capture_exception")
+def test_captures_errors_raised_by_different_lines_to_sentry(capture_exception_fn):
+    sentry = SentryReporter()
+    sentry.capture(_raised(lambda: int("actor")), "render")
+    sentry.capture(_raised(lambda: int("revision")), "render")
+    assert capture_exception_fn.call_count == 2
+
+
+@patch("sentry_sdk.capture_exception")
+def test_captures_exceptions_to_sentry_again_after_window(capture_exception_fn):
+    sentry = SentryReporter()
+    with patch("time.monotonic", return_value=0):
+        sentry.capture(KeyError("actor"), "render")
+        sentry.capture(ValueError("actor"), "render")
+    with patch("time.monotonic", return_value=_SENTRY_DUPLICATE_WINDOW_SECONDS):
+        sentry.capture(KeyError("actor"), "render")
+    assert capture_exception_fn.call_count == 3
+    assert list(sentry._last_captures) == [(KeyError, "render", None)]
+
+
 def test_service_runs_worker():
     worker = Mock()
     db = MockDB(is_initialized=True)
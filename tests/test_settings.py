@@ -100,6 +100,21 @@ def test_parse_ses_mail(mock_boto3_client):
     assert isinstance(mail, SesMail)
 
 
+def test_parse_ses_mail_concurrency():
+    config = _config_parser(
+        """
+    [email]
+    from_address=from@mail
+    implementation=ses
+    [email-ses]
+    max_concurrent_sends=10
+    """
+    )
+    mail = _parse_mail(config, Mock())
+    assert isinstance(mail, SesMail)
+    assert mail._max_concurrent_sends == 10
+
+
 # "smtplib.SMTP" immediately tries to connect to a real server when instantiated,
 # which isn't wanted in these tests, so the constructor is mocked out here.
 @mock.patch("phabricatoremails.settings.smtplib.SMTP")
@@ -3,36 +3,29 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 from phabricatoremails.logging import create_dev_logger
-from phabricatoremails.models import QueryPosition
 from phabricatoremails.worker import PhabricatorWorker
 from tests.mock_query_position_store import MockQueryPositionStore
 from tests.mock_thread_store import MockThreadStore
 
 
 def test_poll_caught_up():
-    position = QueryPosition()
-    position.up_to_key = 10
+    store = MockQueryPositionStore(position_key=10)
 
     def pipeline(*unused):
         return 10
 
     worker = PhabricatorWorker(create_dev_logger(), 60, False)
-    caught_up = worker._poll(
-        MockQueryPositionStore(position=position), MockThreadStore(), pipeline
-    )
+    caught_up = worker._poll(store, MockThreadStore(), pipeline)
     assert caught_up is True
 
 
 def test_poll_fresh_events():
-    position = QueryPosition()
-    position.up_to_key = 10
+    store = MockQueryPositionStore(position_key=10)
 
     def pipeline(*unused):
         return 20
 
     worker = PhabricatorWorker(create_dev_logger(), 60, False)
-    caught_up = worker._poll(
-        MockQueryPositionStore(position=position), MockThreadStore(), pipeline
-    )
+    caught_up = worker._poll(store, MockThreadStore(), pipeline)
     assert caught_up is False
-    assert position.up_to_key == 20
+    assert store.position_key == 20